@@ -1,13 +1,40 @@
 import logging
 import re
 import os
+import csv
+import json
+import queue
+import shutil
+import atexit
+import logging.handlers
+import gzip
+import codecs
+import hashlib
+import math
+import mmap
+import time
+import heapq
+import bisect
+import select
+import tempfile
 import asyncio
+import threading
+import signal
+import itertools
+import functools
+import contextvars
+from array import array
+from contextlib import contextmanager
+from aiohttp import web
 from dotenv import load_dotenv
 import paramiko
-from telegram import Update
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.request import BaseRequest, HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
+    CallbackQueryHandler,
     MessageHandler,
     ContextTypes,
     ConversationHandler,
@@ -16,41 +43,1060 @@ from telegram.ext import (
 
 import psycopg2
 from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_values
 
 load_dotenv()
 
-logging.basicConfig(
-    filename='bot.log',
-    format='%(asctime)s | %(levelname)s | %(message)s',
-    level=logging.INFO
-)
+# Запись в bot.log идет из отдельного потока, обработчики только кладут записи в очередь
+_log_queue = queue.SimpleQueue()
+_log_file = logging.FileHandler('bot.log', encoding='utf-8')
+_log_file.setFormatter(logging.Formatter('%(asctime)s | %(levelname)s | %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_file)
+_log_handler = logging.handlers.QueueHandler(_log_queue)
+_log_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(handlers=[_log_handler], level=logging.INFO)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
 EMAIL_INPUT, PHONE_INPUT, CONFIRM_EMAIL_SAVE, CONFIRM_PHONE_SAVE, PASSWORD, APT_PACKAGE, DB_ACTION = range(7)
 
-def ssh_exec(command: str, timeout: int = 8) -> str:
+EMAIL_RE = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+PHONE_RE = r'(?:\+7|8)[\s\-()]*(\d{3})[\s\-()]*(\d{3})[\s\-]?(\d{2})[\s\-]?(\d{2})'
+EMAIL_PATTERN = re.compile(EMAIL_RE)
+PHONE_PATTERN = re.compile(PHONE_RE)
+SCAN_CHUNK = 1 << 20
+SCAN_OVERLAP = 1024
+SCAN_MAX_FILE = 20 * 1024 * 1024
+SCAN_PREVIEW = 50
+
+class ContactScanner:
+    # Оба шаблона проходят по одному и тому же куску, пока он в памяти:
+    # одно общее регулярное выражение с альтернативой работает вдвое медленнее.
+    def __init__(self):
+        self.emails = {}
+        self.phones = {}
+        self.found = {"email": 0, "phone": 0}
+        self.bytes = 0
+        self._buf = ""
+        self._base = 0
+        self._next = {EMAIL_PATTERN: 0, PHONE_PATTERN: 0}
+
+    def _collect(self, pattern, m):
+        if pattern is EMAIL_PATTERN:
+            self.found["email"] += 1
+            self.emails.setdefault(m.group().lower(), None)
+        else:
+            self.found["phone"] += 1
+            self.phones.setdefault("+7" + "".join(m.groups()), None)
+
+    def _scan(self, buf: str, cut: int):
+        resume = {}
+        for pattern, start in self._next.items():
+            pos = start - self._base
+            deferred = None
+            for m in pattern.finditer(buf, pos):
+                if m.end() > cut:
+                    deferred = m.start()
+                    break
+                self._collect(pattern, m)
+                pos = m.end()
+            resume[pattern] = deferred if deferred is not None else max(pos, cut)
+        return resume
+
+    def feed(self, text: str):
+        buf = self._buf + text
+        resume = self._scan(buf, len(buf) - SCAN_OVERLAP)
+        # один символ перед точкой продолжения нужен для \b
+        keep = max(min(resume.values()) - 1, 0)
+        self._next = {pattern: self._base + pos for pattern, pos in resume.items()}
+        self._buf = buf[keep:]
+        self._base += keep
+
+    def finish(self):
+        self._scan(self._buf, len(self._buf))
+        self._buf = ""
+        return self
+
+def scan_text(text: str) -> ContactScanner:
+    scanner = ContactScanner()
+    scanner.bytes = len(text.encode('utf-8'))
+    scanner.feed(text)
+    return scanner.finish()
+
+def scan_file(path: str, chunk_size: int = SCAN_CHUNK) -> ContactScanner:
+    scanner = ContactScanner()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            scanner.bytes += len(chunk)
+            scanner.feed(decoder.decode(chunk))
+    scanner.feed(decoder.decode(b'', final=True))
+    return scanner.finish()
+
+def preview_list(items: list) -> str:
+    result = "\n".join(f"{i+1}. {x}" for i, x in enumerate(items[:SCAN_PREVIEW]))
+    if len(items) > SCAN_PREVIEW:
+        result += f"\n... и ещё {len(items) - SCAN_PREVIEW}"
+    return result
+
+PASSWORD_MIN_LENGTH = 8
+PASSWORD_MIN_ENTROPY = float(os.getenv("PASSWORD_MIN_ENTROPY", 50))
+PASSWORD_BATCH_MAX = int(os.getenv("PASSWORD_BATCH_MAX", 100000))
+HIBP_PATH = os.getenv("HIBP_PATH")
+PASSWORD_SPECIAL = frozenset("!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~ ")
+CLASS_LOWER, CLASS_UPPER, CLASS_DIGIT, CLASS_SPECIAL, CLASS_OTHER = 1, 2, 4, 8, 16
+# (класс, размер алфавита, название); CLASS_OTHER — кириллица и прочий юникод
+CHAR_CLASSES = (
+    (CLASS_LOWER, 26, "строчные"),
+    (CLASS_UPPER, 26, "заглавные"),
+    (CLASS_DIGIT, 10, "цифры"),
+    (CLASS_SPECIAL, len(PASSWORD_SPECIAL), "спецсимволы"),
+    (CLASS_OTHER, 100, "прочие"),
+)
+POOL_SIZES = [sum(size for bit, size, _ in CHAR_CLASSES if mask & bit) for mask in range(32)]
+
+def password_strength(pwd: str):
+    """Энтропия (бит) и битовая маска классов символов за один проход по паролю"""
+    classes = 0
+    for ch in pwd:
+        if "a" <= ch <= "z":
+            classes |= CLASS_LOWER
+        elif "A" <= ch <= "Z":
+            classes |= CLASS_UPPER
+        elif "0" <= ch <= "9":
+            classes |= CLASS_DIGIT
+        elif ch in PASSWORD_SPECIAL:
+            classes |= CLASS_SPECIAL
+        else:
+            classes |= CLASS_OTHER
+    pool = POOL_SIZES[classes]
+    return (len(pwd) * math.log2(pool) if pool else 0.0), classes
+
+def class_names(classes: int) -> str:
+    return ", ".join(name for bit, _, name in CHAR_CLASSES if classes & bit)
+
+class BreachIndex:
+    # Файл утечек в формате HIBP ("SHA1:count", отсортирован по хешу) не читается в память:
+    # mmap отдает страницы по требованию, поиск — двоичный по началам строк.
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.lookups = 0
+
+    def lookup(self, pwd: str) -> int:
+        """Сколько раз пароль встречается в утечках (0 — не найден)"""
+        return self.lookup_hash(hashlib.sha1(pwd.encode('utf-8')).hexdigest().upper().encode())
+
+    def lookup_hash(self, digest: bytes) -> int:
+        self.lookups += 1
+        mm = self._mm
+        lo, hi = 0, len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = mm.rfind(b"\n", lo, mid) + 1 or lo
+            end = mm.find(b"\n", start, hi)
+            if end < 0:
+                end = hi
+            key = mm[start:start + len(digest)]
+            if key < digest:
+                lo = end + 1
+            elif key > digest:
+                hi = start
+            else:
+                count = mm[start + len(digest) + 1:end].strip()
+                return int(count) if count.isdigit() else 1
+        return 0
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+BREACH_INDEX = None
+_breach_lock = threading.Lock()
+
+def get_breach_index():
+    """Индекс утечек или None, если HIBP_PATH не задан"""
+    global BREACH_INDEX
+    if not HIBP_PATH:
+        return None
+    with _breach_lock:
+        if BREACH_INDEX is None:
+            BREACH_INDEX = BreachIndex(HIBP_PATH)
+        return BREACH_INDEX
+
+def check_password(pwd: str, index: BreachIndex = None):
+    """(энтропия, классы, число утечек, список замечаний); пустой список — пароль сложный"""
+    entropy, classes = password_strength(pwd)
+    breached = index.lookup(pwd) if index else 0
+    problems = []
+    if len(pwd) < PASSWORD_MIN_LENGTH:
+        problems.append(f"короче {PASSWORD_MIN_LENGTH} символов")
+    missing = [name for bit, _, name in CHAR_CLASSES[:3] if not classes & bit]
+    if not classes & (CLASS_SPECIAL | CLASS_OTHER):
+        missing.append("спецсимволы")
+    if missing:
+        problems.append("нет символов: " + ", ".join(missing))
+    if entropy < PASSWORD_MIN_ENTROPY:
+        problems.append(f"энтропия {entropy:.0f} бит (нужно от {PASSWORD_MIN_ENTROPY:.0f})")
+    if breached:
+        problems.append(f"встречается в утечках ({breached} раз)")
+    return entropy, classes, breached, problems
+
+def check_password_file(path: str, report_path: str) -> dict:
+    """Проверяет список паролей (по одному в строке) и пишет отчет в CSV.gz без самих паролей"""
+    index = get_breach_index()
+    stats = {"total": 0, "strong": 0, "weak": 0, "breached": 0, "truncated": False}
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    with open(path, 'rb') as f, gzip.open(report_path, 'wt', encoding='utf-8', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(["line", "length", "entropy", "classes", "breached", "problems"])
+        for lineno, raw in enumerate(f, 1):
+            pwd = decoder.decode(raw).rstrip("\r\n")
+            if not pwd:
+                continue
+            if stats["total"] >= PASSWORD_BATCH_MAX:
+                stats["truncated"] = True
+                break
+            entropy, classes, breached, problems = check_password(pwd, index)
+            stats["total"] += 1
+            stats["strong" if not problems else "weak"] += 1
+            stats["breached"] += bool(breached)
+            writer.writerow([lineno, len(pwd), f"{entropy:.1f}", class_names(classes), breached, "; ".join(problems)])
+    return stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", 2))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+TRACE_PHASES = ("queue", "connect", "exec", "db", "reply")
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return 0.0
+
+class Telemetry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.errors = {}
+        self.inflight = {}
+        self.gauges = {}
+
+    def observe(self, kind: str, name: str, seconds: float):
+        with self.lock:
+            self.latency.setdefault((kind, name), Histogram()).observe(seconds)
+
+    def error(self, kind: str, name: str):
+        with self.lock:
+            self.errors[(kind, name)] = self.errors.get((kind, name), 0) + 1
+
+    def track(self, kind: str, name: str, delta: int):
+        with self.lock:
+            self.inflight[(kind, name)] = self.inflight.get((kind, name), 0) + delta
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            latency = {k: (list(h.counts), h.total, h.count) for k, h in self.latency.items()}
+            errors = dict(self.errors)
+            inflight = dict(self.inflight)
+        for kind in sorted({k for k, _ in latency}):
+            lines.append(f"# TYPE bot_{kind}_seconds histogram")
+            for (k, name), (counts, total, count) in sorted(latency.items()):
+                if k != kind:
+                    continue
+                cumulative = 0
+                for le, c in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                    cumulative += c
+                    lines.append(f'bot_{kind}_seconds_bucket{{name="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'bot_{kind}_seconds_sum{{name="{name}"}} {total:.6f}')
+                lines.append(f'bot_{kind}_seconds_count{{name="{name}"}} {count}')
+        lines.append("# TYPE bot_errors_total counter")
+        for (kind, name), n in sorted(errors.items()):
+            lines.append(f'bot_errors_total{{kind="{kind}",name="{name}"}} {n}')
+        lines.append("# TYPE bot_inflight gauge")
+        for (kind, name), n in sorted(inflight.items()):
+            lines.append(f'bot_inflight{{kind="{kind}",name="{name}"}} {n}')
+        for name, func in self.gauges.items():
+            lines.append(f"# TYPE bot_{name} gauge")
+            lines.append(f"bot_{name} {func()}")
+        return "\n".join(lines) + "\n"
+
+TELEMETRY = Telemetry()
+REQUEST_TRACE = contextvars.ContextVar("request_trace", default=None)
+
+def add_phase(phase: str, seconds: float):
+    trace = REQUEST_TRACE.get()
+    if trace is not None:
+        trace[phase] = trace.get(phase, 0.0) + seconds
+
+def note_error(e: BaseException):
+    """Запоминает ошибку в трассе запроса: в журнал попадают и те, что обработчик превратил в ответ"""
+    trace = REQUEST_TRACE.get()
+    if trace is not None and "error" not in trace:
+        trace["error"] = f"{type(e).__name__}: {e}"
+
+def timed(kind: str, phase: str = None):
+    # Время соединения учитывается отдельной фазой connect и из phase вычитается.
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = REQUEST_TRACE.get()
+            connect_before = trace.get("connect", 0.0) if trace is not None else 0.0
+            TELEMETRY.track(kind, name, 1)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                TELEMETRY.error(kind, name)
+                note_error(e)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                TELEMETRY.track(kind, name, -1)
+                TELEMETRY.observe(kind, name, elapsed)
+                if phase and trace is not None:
+                    add_phase(phase, elapsed - (trace.get("connect", 0.0) - connect_before))
+        return wrapper
+    return decorator
+
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "bot_journal.jsonl")
+JOURNAL_MAX_BYTES = int(os.getenv("JOURNAL_MAX_BYTES", 50 * 1024 * 1024))
+JOURNAL_KEEP = int(os.getenv("JOURNAL_KEEP", 5))
+JOURNAL_PREFIX = b'{"ts": '
+JOURNAL_QUEUE = 10000
+JOURNAL_BATCH = 512
+JOURNAL_STOP_TIMEOUT = 5
+
+class Journal:
+    # Каждая строка начинается с "ts", чтобы journal_query.py мог искать по времени
+    # двоичным поиском, не разбирая JSON целиком.
+    _STOP = object()
+
+    def __init__(self, path: str, max_bytes: int, keep: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.queue = queue.Queue(JOURNAL_QUEUE)
+        self.dropped = 0
+        self.thread = None
+
+    def record(self, entry: dict):
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="journal", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        # Не ждем бесконечно: если писатель умер, очередь уже не разберется.
+        if self.thread is not None:
+            if self.thread.is_alive():
+                try:
+                    self.queue.put(self._STOP, timeout=JOURNAL_STOP_TIMEOUT)
+                except queue.Full:
+                    logging.error("Journal: writer is stuck, entries left in queue are lost")
+                self.thread.join(JOURNAL_STOP_TIMEOUT)
+            self.thread = None
+
+    def _rotate(self):
+        for i in range(self.keep - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}.gz"):
+                os.replace(f"{self.path}.{i}.gz", f"{self.path}.{i + 1}.gz")
+        with open(self.path, "rb") as src, gzip.open(f"{self.path}.1.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(self.path)
+
+    def _set_aside_foreign(self):
+        # Чужой файл по тому же пути не дописываем: journal_query.py ждет строки с "ts" в начале.
+        try:
+            with open(self.path, "rb") as f:
+                head = f.read(len(JOURNAL_PREFIX))
+        except FileNotFoundError:
+            return
+        if head and head != JOURNAL_PREFIX:
+            aside = f"{self.path}.{int(time.time())}.orig"
+            os.replace(self.path, aside)
+            logging.warning(f"Journal: {self.path} is not a journal, moved to {aside}")
+
+    def _run(self):
+        try:
+            self._set_aside_foreign()
+        except OSError as e:
+            logging.error(f"Journal write error: {e}")
+        f = self._open()
+        size = f.tell() if f else 0
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while len(batch) < JOURNAL_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = self._STOP in batch
+            data = b"".join(
+                json.dumps(e, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+                for e in batch if e is not self._STOP
+            )
+            if f is None:
+                # файл не открылся раньше — пробуем снова, иначе пачка теряется, но очередь разбирается
+                f = self._open()
+                if f is None:
+                    self.dropped += len(batch) - stop
+                    continue
+                size = f.tell()
+            try:
+                f.write(data)
+                f.flush()
+                size += len(data)
+            except OSError as e:
+                logging.error(f"Journal write error: {e}")
+            if size >= self.max_bytes:
+                f.close()
+                try:
+                    self._rotate()
+                except OSError as e:
+                    logging.error(f"Journal rotate error: {e}")
+                finally:
+                    f = self._open()
+                    size = f.tell() if f else 0
+        if f is not None:
+            f.close()
+
+    def _open(self):
+        try:
+            return open(self.path, "ab")
+        except OSError as e:
+            logging.error(f"Journal open error: {e}")
+            return None
+
+JOURNAL = Journal(JOURNAL_PATH, JOURNAL_MAX_BYTES, JOURNAL_KEEP)
+TELEMETRY.gauges["journal_dropped"] = lambda: JOURNAL.dropped
+
+def instrument(callback):
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        trace = {}
+        token = REQUEST_TRACE.set(trace)
+        TELEMETRY.track("handler", name, 1)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            TELEMETRY.error("handler", name)
+            note_error(e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            TELEMETRY.track("handler", name, -1)
+            TELEMETRY.observe("handler", name, elapsed)
+            REQUEST_TRACE.reset(token)
+            JOURNAL.record({
+                "ts": round(time.time(), 3),
+                "user": update.effective_user.id if update.effective_user else None,
+                "chat": update.effective_chat.id if update.effective_chat else None,
+                "command": command_key(update),
+                "handler": name,
+                "duration_ms": round(elapsed * 1000, 1),
+                "result_bytes": int(trace.get("bytes", 0)),
+                "error": trace.get("error"),
+            })
+            if elapsed >= SLOW_REQUEST_SECONDS:
+                user_id = update.effective_user.id if update.effective_user else None
+                phases = " ".join(f"{p}={trace.get(p, 0.0):.3f}" for p in TRACE_PHASES)
+                logging.warning(f"Slow request {name} user={user_id} total={elapsed:.3f} {phases}")
+    return wrapper
+
+def instrument_handlers(handlers: list):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        else:
+            handler.callback = instrument(handler.callback)
+
+def request_size(request_data) -> int:
+    if request_data is None:
+        return 0
+    if not request_data.contains_files:
+        return len(request_data.json_payload)
+    return sum(len(v[1]) if isinstance(v, tuple) else len(str(v)) for v in request_data.multipart_data.values())
+
+class TimedRequest(HTTPXRequest):
+    async def do_request(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            add_phase("reply", elapsed)
+            add_phase("bytes", request_size(kwargs.get("request_data")))
+            TELEMETRY.observe("telegram", "api", elapsed)
+
+_ssh_client = None
+_ssh_lock = threading.Lock()
+
+def ssh_connect(timeout: int = 8) -> paramiko.SSHClient:
+    global _ssh_client
+    with _ssh_lock:
+        transport = _ssh_client.get_transport() if _ssh_client else None
+        if transport is None or not transport.is_active():
+            started = time.perf_counter()
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(
+                hostname=os.getenv("RM_HOST"),
+                port=int(os.getenv("RM_PORT", 22)),
+                username=os.getenv("RM_USER"),
+                password=os.getenv("RM_PASSWORD"),
+                timeout=timeout
+            )
+            client.get_transport().set_keepalive(30)
+            _ssh_client = client
+            elapsed = time.perf_counter() - started
+            add_phase("connect", elapsed)
+            TELEMETRY.observe("ssh", "connect", elapsed)
+        return _ssh_client
+
+def ssh_reset():
+    global _ssh_client
+    with _ssh_lock:
+        if _ssh_client:
+            _ssh_client.close()
+        _ssh_client = None
+
+def ssh_drop_if_dead(client: paramiko.SSHClient):
+    # Соединение общее для сэмплера, LogFollower и ssh_stream: ошибка одного канала
+    # (например, таймаут чтения) не должна закрывать транспорт под чужими каналами.
+    global _ssh_client
+    with _ssh_lock:
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            client.close()
+            if _ssh_client is client:
+                _ssh_client = None
+
+@timed("ssh", "exec")
+def ssh_run(command: str, timeout: int = 8) -> tuple:
+    client = ssh_connect(timeout)
+    channel = None
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(
-            hostname=os.getenv("RM_HOST"),
-            port=int(os.getenv("RM_PORT", 22)),
-            username=os.getenv("RM_USER"),
-            password=os.getenv("RM_PASSWORD"),
-            timeout=timeout
-        )
         stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+        channel = stdout.channel
         output = stdout.read().decode('utf-8', errors='replace')
         error = stderr.read().decode('utf-8', errors='replace')
-        client.close()
-        result = (output or error or "Нет данных").strip()
-        return result if len(result) <= 4000 else result[:3997] + ""
-    except Exception as e:
-        return f"Ошибка SSH: {str(e)[:150]}"
+    except Exception:
+        ssh_drop_if_dead(client)
+        raise
+    finally:
+        if channel is not None:
+            channel.close()
+    return output, error
+
+MESSAGE_LIMIT = 4000
+SSH_READ_SIZE = 32768
+SSH_POLL = 0.5
+SSH_STREAM_DEADLINE = int(os.getenv("SSH_STREAM_DEADLINE", 120))
+SSH_PROGRESS_INTERVAL = 3
+SSH_MAX_PAGES = 5
+SSH_STDERR_LIMIT = MESSAGE_LIMIT
+
+def utf8_cut(data: bytes, limit: int) -> bytes:
+    """Не больше limit байт, не разрезая многобайтовый символ UTF-8"""
+    if len(data) <= limit:
+        return data
+    while limit > 0 and data[limit] & 0xC0 == 0x80:
+        limit -= 1
+    return data[:limit]
+
+class SshOutput:
+    # Вывод держится в памяти, пока помещается в SSH_MAX_PAGES сообщений,
+    # дальше всё пишется в сжатый временный файл.
+    def __init__(self, limit: int = SSH_MAX_PAGES * MESSAGE_LIMIT):
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.stderr = bytearray()
+        self.stderr_size = 0
+        self.spill_path = None
+        self._raw = None
+        self._spill = None
+        self.timed_out = False
+        self.started = time.monotonic()
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self._spill is None and self.size > self.limit:
+            fd, self.spill_path = tempfile.mkstemp(suffix=".txt.gz")
+            self._raw = os.fdopen(fd, "wb")
+            self._spill = gzip.GzipFile(fileobj=self._raw, mode="wb")
+            self._spill.writelines(self.parts)
+            self.parts = []
+        if self._spill is not None:
+            self._spill.write(data)
+        else:
+            self.parts.append(data)
+
+    def write_err(self, data: bytes):
+        room = SSH_STDERR_LIMIT - len(self.stderr)
+        self.stderr_size += len(data)
+        if room > 0:
+            self.stderr += utf8_cut(data, room)
+
+    def stderr_text(self) -> str:
+        text = bytes(self.stderr).decode('utf-8', errors='replace').strip()
+        if self.stderr_size > len(self.stderr):
+            text += f"\n[stderr обрезан: показано {len(self.stderr)} из {self.stderr_size} байт]"
+        return text
+
+    def text(self) -> str:
+        output = b"".join(self.parts).decode('utf-8', errors='replace').strip()
+        errors = self.stderr_text()
+        if output and errors:
+            return f"{output}\n\n[stderr]\n{errors}"
+        return output or errors or "Нет данных"
+
+    def close(self):
+        if self._spill is not None:
+            errors = self.stderr_text()
+            if errors:
+                self._spill.write(f"\n\n[stderr]\n{errors}\n".encode('utf-8'))
+            self._spill.close()
+            self._raw.close()
+            self._spill = None
+
+    def cleanup(self):
+        self.close()
+        if self.spill_path:
+            os.unlink(self.spill_path)
+            self.spill_path = None
+
+@timed("ssh", "exec")
+def ssh_stream(command: str, out: SshOutput, timeout: int = 8, deadline: int = SSH_STREAM_DEADLINE):
+    client = ssh_connect(timeout)
+    try:
+        channel = client.get_transport().open_session(timeout=timeout)
+    except Exception:
+        ssh_drop_if_dead(client)
+        raise
+    try:
+        channel.exec_command(command)
+        stop = time.monotonic() + deadline
+        while True:
+            if channel.recv_stderr_ready():
+                out.write_err(channel.recv_stderr(SSH_READ_SIZE))
+            if channel.recv_ready():
+                out.write(channel.recv(SSH_READ_SIZE))
+            elif channel.eof_received or channel.closed:
+                break
+            elif time.monotonic() > stop:
+                out.timed_out = True
+                break
+            else:
+                select.select([channel], [], [], SSH_POLL)
+        while channel.recv_stderr_ready():
+            out.write_err(channel.recv_stderr(SSH_READ_SIZE))
+        # закрытый вместе с транспортом канал тоже выглядит как EOF, но без кода завершения
+        # (exit_status остается -1): такой вывод нельзя выдавать за полный
+        if not out.timed_out:
+            channel.status_event.wait(timeout)
+            if channel.exit_status < 0 and not channel.get_transport().is_active():
+                ssh_drop_if_dead(client)
+                raise paramiko.SSHException("SSH-соединение разорвано, вывод неполный")
+    finally:
+        channel.close()
+        out.close()
+    return out
+
+def paginate(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    pages = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        pages.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    pages.append(text)
+    return pages
+
+async def deliver_output(update: Update, out: SshOutput, name: str):
+    note = f"\n\n[Команда прервана через {SSH_STREAM_DEADLINE} с]" if out.timed_out else ""
+    if out.spill_path is None:
+        pages = paginate(out.text() + note)
+        for i, page in enumerate(pages, 1):
+            header = f"({i}/{len(pages)})\n" if len(pages) > 1 else ""
+            await update.message.reply_text(header + page)
+        return
+    with open(out.spill_path, "rb") as f:
+        await update.message.reply_document(
+            f, filename=f"{name}.txt.gz",
+            caption=f"Вывод слишком большой для сообщений: {out.size // 1024} КБ{note}"
+        )
+
+METRICS_INTERVAL = int(os.getenv("METRICS_INTERVAL", 30))
+METRICS_RETENTION = int(os.getenv("METRICS_RETENTION", 86400))
+METRIC_NAMES = ("load", "mem", "disk", "cpu")
+ALERT_THRESHOLDS = {
+    "load": float(os.getenv("ALERT_LOAD", 4)),
+    "mem": float(os.getenv("ALERT_MEM", 90)),
+    "disk": float(os.getenv("ALERT_DISK", 90)),
+    "cpu": float(os.getenv("ALERT_CPU", 90)),
+}
+TREND_UNITS = {"m": 60, "h": 3600, "d": 86400}
+TREND_BUCKETS = 12
+SAMPLE_CMD = (
+    "cat /proc/loadavg; "
+    "grep -E '^(MemTotal|MemAvailable):' /proc/meminfo; "
+    "head -n1 /proc/stat; "
+    "df -P / | tail -n1"
+)
+
+class RingSeries:
+    __slots__ = ("times", "values", "size", "pos", "count")
+
+    def __init__(self, size: int):
+        self.times = array('d', [0.0]) * size
+        self.values = array('d', [0.0]) * size
+        self.size = size
+        self.pos = 0
+        self.count = 0
+
+    def append(self, ts: float, value: float):
+        self.times[self.pos] = ts
+        self.values[self.pos] = value
+        self.pos = (self.pos + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def since(self, ts: float):
+        start = (self.pos - self.count) % self.size
+        for i in range(self.count):
+            j = (start + i) % self.size
+            if self.times[j] >= ts:
+                yield self.times[j], self.values[j]
+
+METRICS = {}
+ALERT_SUBSCRIBERS = set()
+ALERT_ACTIVE = set()
 
-async def send_monitoring_result(update: Update, command: str, msg: str = "Выполняю запрос"):
-    await update.message.reply_text(f"{msg}")
-    out = await asyncio.to_thread(ssh_exec, command)
-    await update.message.reply_text(out)
+def series(host: str, metric: str) -> RingSeries:
+    key = (host, metric)
+    if key not in METRICS:
+        METRICS[key] = RingSeries(max(METRICS_RETENTION // METRICS_INTERVAL, 1))
+    return METRICS[key]
+
+def parse_sample(raw: str, prev_cpu: tuple = None) -> tuple:
+    sample = {}
+    mem = {}
+    cpu = None
+    for i, line in enumerate(raw.splitlines()):
+        parts = line.split()
+        if i == 0 and parts:
+            sample["load"] = float(parts[0])
+        elif line.startswith("Mem"):
+            mem[parts[0].rstrip(':')] = int(parts[1])
+        elif line.startswith("cpu "):
+            fields = [int(x) for x in parts[1:]]
+            cpu = (sum(fields[3:5]), sum(fields))
+        elif len(parts) >= 6 and parts[4].endswith('%'):
+            sample["disk"] = float(parts[4].rstrip('%'))
+    if mem.get("MemTotal"):
+        sample["mem"] = 100.0 * (1 - mem.get("MemAvailable", 0) / mem["MemTotal"])
+    if cpu and prev_cpu and cpu[1] > prev_cpu[1]:
+        sample["cpu"] = 100.0 * (1 - (cpu[0] - prev_cpu[0]) / (cpu[1] - prev_cpu[1]))
+    return sample, cpu
+
+def parse_window(text: str) -> int:
+    m = re.fullmatch(r'(\d+)([mhd])', text.strip().lower())
+    if not m:
+        return 0
+    return int(m.group(1)) * TREND_UNITS[m.group(2)]
+
+def downsample(points, start: float, window: int, buckets: int = TREND_BUCKETS) -> list:
+    stats = [None] * buckets
+    for ts, value in points:
+        i = min(int((ts - start) * buckets / window), buckets - 1)
+        b = stats[i]
+        if b is None:
+            stats[i] = [value, value, value, 1]
+        else:
+            b[0] = min(b[0], value)
+            b[1] = max(b[1], value)
+            b[2] += value
+            b[3] += 1
+    return [
+        (start + i * window / buckets, b[0], b[2] / b[3], b[1])
+        for i, b in enumerate(stats) if b is not None
+    ]
+
+async def push_alert(app: Application, text: str):
+    for chat_id in list(ALERT_SUBSCRIBERS):
+        try:
+            await app.bot.send_message(chat_id, text)
+        except Exception as e:
+            logging.warning(f"Alert to {chat_id} failed: {e}")
+
+async def check_alerts(app: Application, host: str, sample: dict):
+    for metric, value in sample.items():
+        key = (host, metric)
+        if value >= ALERT_THRESHOLDS[metric] and key not in ALERT_ACTIVE:
+            ALERT_ACTIVE.add(key)
+            await push_alert(app, f"{host}: {metric} = {value:.1f} (порог {ALERT_THRESHOLDS[metric]:g})")
+        elif value < ALERT_THRESHOLDS[metric] and key in ALERT_ACTIVE:
+            ALERT_ACTIVE.discard(key)
+            await push_alert(app, f"{host}: {metric} = {value:.1f}, вернулось в норму")
+
+async def metrics_sampler(app: Application):
+    host = os.getenv("RM_HOST")
+    prev_cpu = None
+    while True:
+        try:
+            output, _ = await asyncio.to_thread(ssh_run, SAMPLE_CMD)
+            sample, prev_cpu = parse_sample(output, prev_cpu)
+            now = time.time()
+            for metric, value in sample.items():
+                series(host, metric).append(now, value)
+            await check_alerts(app, host, sample)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Metrics sample failed: {e}")
+        await asyncio.sleep(METRICS_INTERVAL)
+
+SCHED_WORKERS = int(os.getenv("SCHED_WORKERS", 4))
+SCHED_QUEUE = int(os.getenv("SCHED_QUEUE", 20))
+PRIORITY_CHEAP, PRIORITY_HEAVY = range(2)
+HEAVY_COMMANDS = {
+    "get_apt_list", "get_critical", "get_ps", "get_services", "get_auths",
+    "get_repl_logs", "export", "scan_file", "password_batch",
+    "save_emails", "save_phones",
+}
+# (пополнение токенов в секунду, емкость корзины)
+USER_LIMIT = (0.5, 10)
+COMMAND_LIMITS = {
+    PRIORITY_CHEAP: (0.2, 5),
+    PRIORITY_HEAVY: (1 / 30, 2),
+}
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def wait_time(self) -> float:
+        """Сколько секунд ждать до следующего токена (0 — токен есть); токен не списывается"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def idle_full(self, now: float, idle: float) -> bool:
+        """Корзина не трогалась idle секунд и уже наполнилась: ее можно забыть без потери лимита"""
+        return now - self.updated >= idle and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    def take(self) -> float:
+        wait = self.wait_time()
+        if not wait:
+            self.tokens -= 1
+        return wait
+
+class SchedulerOverloaded(Exception):
+    pass
+
+OVERLOADED_TEXT = "Бот перегружен, попробуйте позже"
+RATE_LIMITED_TEXT = "Слишком много запросов"
+QUEUED_TEXT = "Запрос поставлен в очередь"
+
+class Scheduler:
+    # Не больше workers заданий одновременно, остальные ждут в куче по приоритету.
+    # Освободившийся слот передается следующему ожидающему без повторной борьбы за него.
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.running = 0
+        self.heap = []
+        self.seq = itertools.count()
+        self.stats = {"submitted": 0, "queued": 0, "shed": 0, "limited": 0}
+
+    def waiting(self) -> int:
+        return sum(1 for entry in self.heap if not entry[2].done())
+
+    def _release(self):
+        while self.heap:
+            _, _, fut = heapq.heappop(self.heap)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.running -= 1
+
+    async def submit(self, priority: int, func, *args, on_wait=None):
+        self.stats["submitted"] += 1
+        if self.running < self.workers:
+            self.running += 1
+        else:
+            if self.waiting() >= self.max_queue:
+                self.stats["shed"] += 1
+                raise SchedulerOverloaded()
+            fut = asyncio.get_running_loop().create_future()
+            entry = (priority, next(self.seq), fut)
+            heapq.heappush(self.heap, entry)
+            self.stats["queued"] += 1
+            queued_at = time.perf_counter()
+            try:
+                if on_wait:
+                    await on_wait(sum(1 for e in self.heap if e <= entry and not e[2].done()))
+                await fut
+            except BaseException:
+                # слот уже передан нам — отдаем следующему; иначе снимаем заявку с очереди
+                if fut.done() and not fut.cancelled():
+                    self._release()
+                else:
+                    fut.cancel()
+                raise
+            waited = time.perf_counter() - queued_at
+            add_phase("queue", waited)
+            TELEMETRY.observe("queue", f"priority{priority}", waited)
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            self._release()
+
+SCHEDULER = Scheduler(SCHED_WORKERS, SCHED_QUEUE)
+TELEMETRY.gauges["scheduler_running"] = lambda: SCHEDULER.running
+TELEMETRY.gauges["scheduler_waiting"] = SCHEDULER.waiting
+USER_BUCKETS = {}
+COMMAND_BUCKETS = {}
+BUCKET_IDLE = 600
+_buckets_pruned = time.monotonic()
+
+def prune_buckets():
+    # Полная корзина ничем не отличается от новой, поэтому простаивающие удаляются,
+    # иначе словари растут на каждого пользователя и команду за все время работы.
+    global _buckets_pruned
+    now = time.monotonic()
+    if now - _buckets_pruned < BUCKET_IDLE:
+        return
+    _buckets_pruned = now
+    for buckets in (USER_BUCKETS, COMMAND_BUCKETS):
+        for key in [k for k, bucket in buckets.items() if bucket.idle_full(now, BUCKET_IDLE)]:
+            del buckets[key]
+
+TELEMETRY.gauges["rate_buckets"] = lambda: len(USER_BUCKETS) + len(COMMAND_BUCKETS)
+
+def command_key(update: Update) -> str:
+    text = (update.effective_message.text or "") if update.effective_message else ""
+    if text.startswith("/"):
+        return text[1:].split()[0].split("@")[0]
+    return "message"
+
+def command_priority(key: str) -> int:
+    return PRIORITY_HEAVY if key in HEAVY_COMMANDS else PRIORITY_CHEAP
+
+async def admit(update: Update, key: str) -> bool:
+    prune_buckets()
+    user_id = update.effective_user.id
+    priority = command_priority(key)
+    user_bucket = USER_BUCKETS.setdefault(user_id, TokenBucket(*USER_LIMIT))
+    command_bucket = COMMAND_BUCKETS.setdefault((user_id, key), TokenBucket(*COMMAND_LIMITS[priority]))
+    # токен списывается только если обе корзины пропускают запрос
+    wait = max(user_bucket.wait_time(), command_bucket.wait_time())
+    if wait:
+        SCHEDULER.stats["limited"] += 1
+        await update.effective_message.reply_text(f"{RATE_LIMITED_TEXT}, повторите через {wait:.0f} с")
+        return False
+    user_bucket.take()
+    command_bucket.take()
+    return True
+
+def queue_notifier(update: Update):
+    async def on_wait(position: int):
+        await update.effective_message.reply_text(f"{QUEUED_TEXT}, позиция: {position}")
+    return on_wait
+
+async def run_scheduled(update: Update, key: str, func, *args):
+    if not await admit(update, key):
+        return None
+    try:
+        return await SCHEDULER.submit(command_priority(key), func, *args, on_wait=queue_notifier(update))
+    except SchedulerOverloaded as e:
+        note_error(e)
+        await update.effective_message.reply_text(OVERLOADED_TEXT)
+        return None
+
+async def send_monitoring_result(update: Update, command: str, msg: str = "Выполняю запрос", key: str = None):
+    key = key or command_key(update)
+    if not await admit(update, key):
+        return
+    status = await update.message.reply_text(f"{msg}")
+    out = SshOutput()
+    task = asyncio.ensure_future(SCHEDULER.submit(
+        command_priority(key), ssh_stream, command, out, on_wait=queue_notifier(update)
+    ))
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=SSH_PROGRESS_INTERVAL)
+            if not task.done():
+                elapsed = time.monotonic() - out.started
+                try:
+                    await status.edit_text(f"{msg}: получено {out.size // 1024} КБ за {elapsed:.0f} с")
+                except BadRequest:
+                    pass
+        try:
+            task.result()
+        except SchedulerOverloaded as e:
+            note_error(e)
+            await update.message.reply_text(OVERLOADED_TEXT)
+            return
+        except Exception as e:
+            note_error(e)
+            await update.message.reply_text(f"Ошибка SSH: {str(e)[:150]}")
+            return
+        name = re.sub(r'\W+', '_', command.split()[0]).strip('_') or "output"
+        await deliver_output(update, out, name)
+    finally:
+        if task.done():
+            out.cleanup()
+        else:
+            task.add_done_callback(lambda _: out.cleanup())
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -61,34 +1107,72 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Доступные команды:\n"
         "/find_email\n/find_phone_number\n/verify_password\n\n"
         "Команды мониторинга:\n"
-        "/get_release\n/get_uname\n/get_uptime\n/get_df\n/get_free\n/get_mpstat\n/get_w\n/get_auths\n/get_critical\n/get_ps\n/get_ss\n/get_apt_list\n/get_services\n\n"
+        "/get_release\n/get_uname\n/get_uptime\n/get_df\n/get_free\n/get_mpstat\n/get_w\n/get_auths\n/get_critical\n/get_ps\n/get_ss\n/get_apt_list\n/get_services\n"
+        "/trend\n/subscribe_alerts\n/unsubscribe_alerts\n\n"
         "Команды взаимодействия с базой данных\n"
-        "/get_repl_logs\n/get_emails\n/get_phone_numbers\n"
+        "/get_repl_logs\n/subscribe_repl\n/unsubscribe_repl\n/get_emails\n/get_phone_numbers\n/export\n/db_pool_stats\n"
     )
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("HELP! -> /start")
 
 async def find_email_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Пришлите текст для поиска email:")
+    await update.message.reply_text("Пришлите текст или файл для поиска email:")
     return EMAIL_INPUT
 
 async def find_phone_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Пришлите текст для поиска номеров телефонов:")
+    await update.message.reply_text("Пришлите текст или файл для поиска номеров телефонов:")
     return PHONE_INPUT
 
 async def verify_password_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Пришлите пароль для проверки сложности:")
+    await update.message.reply_text("Пришлите пароль для проверки сложности или файл со списком паролей (по одному в строке):")
     return PASSWORD
 
+async def process_upload(update: Update, key: str, func, *args):
+    # Файл скачивается во временный каталог, func(path, *args) выполняется в планировщике.
+    # Возвращает результат func или None, если файл не принят.
+    doc = update.message.document
+    if doc.file_size and doc.file_size > SCAN_MAX_FILE:
+        await update.message.reply_text(f"Файл слишком большой (максимум {SCAN_MAX_FILE // (1024 * 1024)} МБ)")
+        return None
+    if not await admit(update, key):
+        return None
+    await update.message.reply_text("Обрабатываю файл")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "upload")
+        file = await doc.get_file()
+        await file.download_to_drive(path)
+        try:
+            return await SCHEDULER.submit(PRIORITY_HEAVY, func, path, *args, on_wait=queue_notifier(update))
+        except SchedulerOverloaded as e:
+            note_error(e)
+            await update.message.reply_text(OVERLOADED_TEXT)
+            return None
+
+async def scan_message(update: Update):
+    if not update.message.document:
+        return scan_text(update.message.text)
+    return await process_upload(update, "scan_file", scan_file)
+
+def scanned_size(update: Update, scanner: ContactScanner) -> str:
+    if not update.message.document:
+        return ""
+    size = scanner.bytes
+    return f" в файле {size // 1024} КБ" if size >= 1024 else f" в файле {size} байт"
+
 async def handle_email_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text
-    emails = re.findall(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', text)
+    scanner = await scan_message(update)
+    if scanner is None:
+        return ConversationHandler.END
+    emails = list(scanner.emails)
     if not emails:
-        await update.message.reply_text("Email не найдены")
+        await update.message.reply_text(f"Email не найдены{scanned_size(update, scanner)}")
         return ConversationHandler.END
-    result = "\n".join(f"{i+1}. {e}" for i, e in enumerate(emails))
-    await update.message.reply_text(f"Найдены email:\n{result}\n\nСохранить в базу данных? (y/n)")
+    result = preview_list(emails)
+    await update.message.reply_text(
+        f"Найдены email{scanned_size(update, scanner)} (всего {scanner.found['email']}, уникальных {len(emails)}):\n{result}\n\n"
+        "Сохранить в базу данных? (y/n)"
+    )
     context.user_data['emails_to_save'] = emails
     return CONFIRM_EMAIL_SAVE
 
@@ -96,22 +1180,26 @@ async def confirm_email_save(update: Update, context: ContextTypes.DEFAULT_TYPE)
     answer = update.message.text.strip().lower()
     if answer in ['да', 'yes', 'y', 'д']:
         emails = context.user_data.get('emails_to_save', [])
-        msg = await asyncio.to_thread(db_insert_emails, emails)
-        await update.message.reply_text(msg)
+        msg = await run_scheduled(update, "save_emails", db_insert_emails, emails)
+        if msg is not None:
+            await update.message.reply_text(msg)
     else:
         await update.message.reply_text("Сохранение отменено")
     return ConversationHandler.END
 
 async def handle_phone_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text
-    pattern = r'(?:\+7|8)[\s\-()]*(\d{3})[\s\-()]*(\d{3})[\s\-]?(\d{2})[\s\-]?(\d{2})'
-    matches = re.findall(pattern, text)
-    if not matches:
-        await update.message.reply_text("Номера телефонов не найдены")
+    scanner = await scan_message(update)
+    if scanner is None:
         return ConversationHandler.END
-    numbers = [f"+7{a}{b}{c}{d}" for a, b, c, d in matches]
-    result = "\n".join(f"{i+1}. {n}" for i, n in enumerate(numbers))
-    await update.message.reply_text(f"Найдены номера:\n{result}\n\nСохранить в базу данных? (y/n)")
+    numbers = list(scanner.phones)
+    if not numbers:
+        await update.message.reply_text(f"Номера телефонов не найдены{scanned_size(update, scanner)}")
+        return ConversationHandler.END
+    result = preview_list(numbers)
+    await update.message.reply_text(
+        f"Найдены номера{scanned_size(update, scanner)} (всего {scanner.found['phone']}, уникальных {len(numbers)}):\n{result}\n\n"
+        "Сохранить в базу данных? (y/n)"
+    )
     context.user_data['phones_to_save'] = numbers
     return CONFIRM_PHONE_SAVE
 
@@ -119,22 +1207,51 @@ async def confirm_phone_save(update: Update, context: ContextTypes.DEFAULT_TYPE)
     answer = update.message.text.strip().lower()
     if answer in ['да', 'yes', 'y', 'д']:
         phones = context.user_data.get('phones_to_save', [])
-        msg = await asyncio.to_thread(db_insert_phones, phones)
-        await update.message.reply_text(msg)
+        msg = await run_scheduled(update, "save_phones", db_insert_phones, phones)
+        if msg is not None:
+            await update.message.reply_text(msg)
     else:
         await update.message.reply_text("Сохранение отменено")
     return ConversationHandler.END
 
 async def handle_password_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    pwd = update.message.text
-    if (len(pwd) >= 8 and
-        re.search(r'[A-Z]', pwd) and
-        re.search(r'[a-z]', pwd) and
-        re.search(r'\d', pwd) and
-        re.search(r'[!@#$%^&*()]', pwd)):
-        await update.message.reply_text("Пароль сложный")
+    if update.message.document:
+        return await handle_password_file(update)
+    try:
+        index = get_breach_index()
+    except OSError as e:
+        logging.error(f"Breach index error: {e}")
+        note_error(e)
+        index = None
+    entropy, classes, breached, problems = check_password(update.message.text, index)
+    details = f"Энтропия: {entropy:.0f} бит\nКлассы символов: {class_names(classes)}"
+    if index is None:
+        details += "\nПроверка по утечкам недоступна"
+    if problems:
+        await update.message.reply_text("Пароль простой\n" + "\n".join(f"- {p}" for p in problems) + "\n\n" + details)
     else:
-        await update.message.reply_text("Пароль простой")
+        await update.message.reply_text("Пароль сложный\n\n" + details)
+    return ConversationHandler.END
+
+async def handle_password_file(update: Update):
+    with tempfile.TemporaryDirectory() as tmp:
+        report = os.path.join(tmp, "passwords.csv.gz")
+        try:
+            stats = await process_upload(update, "password_batch", check_password_file, report)
+        except OSError as e:
+            logging.error(f"Password batch error: {e}")
+            note_error(e)
+            await update.message.reply_text(f"Ошибка проверки: {str(e)[:150]}")
+            return ConversationHandler.END
+        if stats is None:
+            return ConversationHandler.END
+        summary = (f"Проверено паролей: {stats['total']}\n"
+                   f"Сложных: {stats['strong']}, простых: {stats['weak']}\n")
+        summary += (f"Найдено в утечках: {stats['breached']}" if HIBP_PATH else "Проверка по утечкам недоступна")
+        if stats["truncated"]:
+            summary += f"\nПроверены только первые {PASSWORD_BATCH_MAX}"
+        with open(report, "rb") as f:
+            await update.message.reply_document(f, filename="passwords.csv.gz", caption=summary)
     return ConversationHandler.END
 
 async def get_release(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -165,7 +1282,7 @@ async def get_critical(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_monitoring_result(update, "journalctl -p crit -n 5 --no-pager", "Критические события")
 
 async def get_ps(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await send_monitoring_result(update, "ps aux | head -n 20", "Процессы")
+    await send_monitoring_result(update, "ps aux", "Процессы")
 
 async def get_ss(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_monitoring_result(update, "ss -tuln", "Используемые порты")
@@ -176,123 +1293,562 @@ async def get_apt_list_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def handle_apt_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pkg = update.message.text.strip()
-    await update.message.reply_text("Информация о пакетах")
     if pkg.lower() == "all":
         cmd = "dpkg -l"
     else:
         cmd = f"apt show {pkg} 2>/dev/null || echo 'Пакет не найден'"
-    out = await asyncio.to_thread(ssh_exec, cmd)
-    await update.message.reply_text(out)
+    await send_monitoring_result(update, cmd, "Информация о пакетах", key="get_apt_list")
     return ConversationHandler.END
 
 async def get_services(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await send_monitoring_result(update, "systemctl list-units --type=service --state=running --no-pager | head -n 20", "Запущенные сервисы")
+    await send_monitoring_result(update, "systemctl list-units --type=service --state=running --no-pager", "Запущенные сервисы")
+
+async def trend(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if len(context.args) != 2 or context.args[0] not in METRIC_NAMES or not parse_window(context.args[1]):
+        await update.message.reply_text(f"Использование: /trend <{'|'.join(METRIC_NAMES)}> <30m|1h|1d>")
+        return
+    metric, window = context.args[0], parse_window(context.args[1])
+    host = os.getenv("RM_HOST")
+    start = time.time() - window
+    rows = downsample(series(host, metric).since(start), start, window)
+    if not rows:
+        await update.message.reply_text("Нет данных за указанный период")
+        return
+    lines = [
+        f"{time.strftime('%H:%M', time.localtime(ts))}  {lo:.1f} / {avg:.1f} / {hi:.1f}"
+        for ts, lo, avg, hi in rows
+    ]
+    await update.message.reply_text(f"{metric} на {host} за {context.args[1]} (min / avg / max):\n" + "\n".join(lines))
+
+async def subscribe_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ALERT_SUBSCRIBERS.add(update.effective_chat.id)
+    await update.message.reply_text("Уведомления о превышении порогов включены")
+
+async def unsubscribe_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ALERT_SUBSCRIBERS.discard(update.effective_chat.id)
+    await update.message.reply_text("Уведомления о превышении порогов выключены")
 
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Неизвестная команда. /start")
 
+REPL_LOG_GLOB = "/var/log/postgresql/postgresql-*.log"
+REPL_PATTERN = "replication|standby|ready"
+REPL_MAX_LINES = 20
+REPL_PUSH_MAX_LINES = 200
+REPL_TAIL_WINDOW = 64 * 1024
+REPL_POLL_INTERVAL = int(os.getenv("REPL_POLL_INTERVAL", 30))
+# Один проход по SSH: найти свежий лог, прочитать только байты после
+# сохраненного смещения (с учетом ротации) и отфильтровать их на хосте.
+# Смещение двигается только до последнего \n: недописанная строка читается в следующий раз.
+# awk считает все совпадения и отдает последние {lines}, чтобы было видно, сколько пропущено.
+REPL_FOLLOW_SCRIPT = """
+f=$(ls -1 {glob} 2>/dev/null | sort | tail -n1)
+if [ -z "$f" ]; then echo NOLOG; exit 0; fi
+set -- $(stat -c '%i %s' "$f")
+ino=$1; size=$2; off={offset}; old=""
+if [ "$off" -lt 0 ]; then
+    off=0
+    if [ {skip} = 1 ]; then off=$((size - {window})); [ "$off" -lt 0 ] && off=0; fi
+elif [ "$ino" != "{inode}" ]; then
+    old=$(find "$(dirname "$f")" -maxdepth 1 -inum {inode} 2>/dev/null | head -n1)
+    off=0
+elif [ "$size" -lt "$off" ]; then
+    off=0
+fi
+ws=$((size - {window})); [ "$ws" -lt "$off" ] && ws=$off
+part=0
+if [ -n "$(tail -c +$((ws + 1)) "$f" | head -c $((size - ws)) | tail -c 1)" ]; then
+    part=$(tail -c +$((ws + 1)) "$f" | head -c $((size - ws)) | tail -n 1 | wc -c)
+fi
+end=$((size - part))
+if [ {skip} = 1 ]; then off=$end; fi
+echo "LOG $ino $end $f"
+{{ [ -n "$old" ] && tail -c +$(({offset} + 1)) "$old"; tail -c +$((off + 1)) "$f" | head -c $((end - off)); }} \\
+    | awk -v n={lines} 'tolower($0) ~ /{pattern}/ {{ c++; buf[c % n] = $0 }}
+        END {{ print "MATCHES " c + 0; for (i = (c > n ? c - n + 1 : 1); i <= c; i++) print buf[i % n] }}'
+"""
+
+class LogFollower:
+    def __init__(self):
+        self.inode = 0
+        self.offset = -1
+
+    def poll(self, max_lines: int = REPL_MAX_LINES, from_end: bool = False) -> tuple:
+        """(путь, последние max_lines совпадений, всего совпадений); from_end — первый вызов
+        только запоминает конец файла, не читая историю"""
+        output, _ = ssh_run(REPL_FOLLOW_SCRIPT.format(
+            glob=REPL_LOG_GLOB, pattern=REPL_PATTERN, lines=max_lines, window=REPL_TAIL_WINDOW,
+            skip=int(from_end and self.offset < 0), inode=self.inode, offset=self.offset
+        ))
+        header, _, body = output.partition("\n")
+        if not header.startswith("LOG "):
+            return None, [], 0
+        _, inode, end, path = header.split(" ", 3)
+        self.inode, self.offset = int(inode), int(end)
+        counter, _, body = body.partition("\n")
+        total = int(counter.split()[1]) if counter.startswith("MATCHES ") else 0
+        return path, [line for line in body.splitlines() if line.strip()], total
+
+REPL_FOLLOWERS = {}
+REPL_SUBSCRIBERS = set()
+
 async def get_repl_logs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Логи репликации PostgreSQL")
-    cmd = "ls /var/log/postgresql/postgresql-*.log 2>/dev/null | sort | tail -n1"
-    log_file = await asyncio.to_thread(ssh_exec, cmd)
-    if not log_file.strip() or "No such file" in log_file:
+    follower = REPL_FOLLOWERS.setdefault(update.effective_chat.id, LogFollower())
+    first = follower.offset < 0
+    try:
+        result = await run_scheduled(update, "get_repl_logs", follower.poll)
+    except Exception as e:
+        note_error(e)
+        await update.message.reply_text(f"Ошибка SSH: {str(e)[:150]}")
+        return
+    if result is None:
+        return
+    path, lines, total = result
+    if path is None:
         await update.message.reply_text("Логи PostgreSQL не найдены")
         return
-    log_file = log_file.strip()
-    grep_cmd = f"grep -i 'replication\\|standby\\|ready' {log_file} | tail -n 20"
-    out = await asyncio.to_thread(ssh_exec, grep_cmd)
-    if not out.strip():
-        out = "Логи репликации не обнаружены"
-    await update.message.reply_text(out[:4000])
-
-def db_query(query: str) -> str:
-    try:
-        conn = psycopg2.connect(
+    if not lines:
+        await update.message.reply_text("Логи репликации не обнаружены" if first else "Новых событий репликации нет")
+        return
+    text = "\n".join(lines)
+    if total > len(lines):
+        text = f"Показаны последние {len(lines)} из {total} событий\n\n" + text
+    for page in paginate(text):
+        await update.message.reply_text(page)
+
+async def subscribe_repl(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    REPL_SUBSCRIBERS.add(update.effective_chat.id)
+    await update.message.reply_text("Уведомления о событиях репликации включены")
+
+async def unsubscribe_repl(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    REPL_SUBSCRIBERS.discard(update.effective_chat.id)
+    await update.message.reply_text("Уведомления о событиях репликации выключены")
+
+async def repl_watcher(app: Application):
+    follower = None
+    while True:
+        await asyncio.sleep(REPL_POLL_INTERVAL)
+        if not REPL_SUBSCRIBERS:
+            follower = None
+            continue
+        try:
+            if follower is None:
+                # первый опрос только запоминает смещение, старые события не рассылаются
+                follower = LogFollower()
+                await asyncio.to_thread(follower.poll, REPL_PUSH_MAX_LINES, True)
+                continue
+            _, lines, total = await asyncio.to_thread(follower.poll, REPL_PUSH_MAX_LINES)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Replication log poll failed: {e}")
+            continue
+        if not lines:
+            continue
+        text = "\n".join(lines)
+        if total > len(lines):
+            text = f"Пропущено более ранних событий: {total - len(lines)}\n\n" + text
+        for page in paginate(text):
+            for chat_id in list(REPL_SUBSCRIBERS):
+                try:
+                    await app.bot.send_message(chat_id, page)
+                except Exception as e:
+                    logging.warning(f"Replication notice to {chat_id} failed: {e}")
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", 30))
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", 1000))
+DB_PAGE_SIZE = 20
+DB_EXPORT_ITERSIZE = 5000
+DB_TABLES = {
+    "emails": ("emails", "email"),
+    "phones": ("phone_numbers", "phone"),
+}
+
+class PoolExhaustedError(Exception):
+    pass
+
+class DbPool:
+    def __init__(self, minconn: int, maxconn: int, timeout: float):
+        self.pool = ThreadedConnectionPool(
+            minconn, maxconn,
             host=os.getenv("DB_HOST"),
             port=os.getenv("DB_PORT"),
             database=os.getenv("DB_DATABASE"),
             user=os.getenv("DB_USER"),
             password=os.getenv("DB_PASSWORD")
         )
-        cur = conn.cursor()
-        cur.execute(query)
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-        if not rows:
-            return "Нет данных"
-        result = "\n".join(f"{i+1}. {row[0]}" for i, row in enumerate(rows))
-        return result[:4000]
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.last_used = {}
+        self.lock = threading.Lock()
+        self.stats = {"acquired": 0, "in_use": 0, "waited": 0, "exhausted": 0, "replaced": 0}
+
+    def _count(self, key: str, delta: int = 1):
+        with self.lock:
+            self.stats[key] += delta
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - self.last_used.get(id(conn), 0) < DB_POOL_CHECK_IDLE:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        conn = self.pool.getconn()
+        while not self._healthy(conn):
+            self._count("replaced")
+            self.last_used.pop(id(conn), None)
+            self.pool.putconn(conn, close=True)
+            conn = self.pool.getconn()
+        return conn
+
+    @contextmanager
+    def connection(self):
+        started = time.perf_counter()
+        if not self.slots.acquire(blocking=False):
+            self._count("waited")
+            if not self.slots.acquire(timeout=self.timeout):
+                self._count("exhausted")
+                raise PoolExhaustedError("пул соединений исчерпан, повторите запрос позже")
+        conn = None
+        try:
+            conn = self._checkout()
+            add_phase("connect", time.perf_counter() - started)
+            self._count("acquired")
+            self._count("in_use")
+            try:
+                yield conn
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                self._count("in_use", -1)
+                self.last_used[id(conn)] = time.monotonic()
+                self.pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self.slots.release()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        stats["size"] = len(self.pool._used) + len(self.pool._pool)
+        stats["idle"] = len(self.pool._pool)
+        stats["max"] = self.maxconn
+        return stats
+
+    def close(self):
+        self.pool.closeall()
+
+DB_POOL = None
+_db_pool_lock = threading.Lock()
+TELEMETRY.gauges["db_pool_in_use"] = lambda: DB_POOL.stats["in_use"] if DB_POOL else 0
+
+def get_db_pool() -> DbPool:
+    global DB_POOL
+    with _db_pool_lock:
+        if DB_POOL is None:
+            DB_POOL = DbPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT)
+        return DB_POOL
+
+@timed("db", "db")
+def db_page(kind: str, direction: str = "", cursor_id: int = 0) -> tuple:
+    table, column = DB_TABLES[kind]
+    query = sql.SQL("SELECT id, {col} FROM {tbl} {where} ORDER BY id {order} LIMIT %s;").format(
+        col=sql.Identifier(column),
+        tbl=sql.Identifier(table),
+        where=sql.SQL("WHERE id > %s" if direction == "prev" else "WHERE id < %s" if direction == "next" else ""),
+        order=sql.SQL("ASC" if direction == "prev" else "DESC")
+    )
+    params = ([cursor_id] if direction else []) + [DB_PAGE_SIZE + 1]
+    with get_db_pool().connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        conn.rollback()
+    more = len(rows) > DB_PAGE_SIZE
+    rows = rows[:DB_PAGE_SIZE]
+    if direction == "prev":
+        rows.reverse()
+        return rows, True, more
+    return rows, more, direction == "next"
+
+def page_markup(kind: str, rows: list, has_older: bool, has_newer: bool):
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton("« Новее", callback_data=f"page:{kind}:prev:{rows[0][0]}"))
+    if has_older:
+        buttons.append(InlineKeyboardButton("Старее »", callback_data=f"page:{kind}:next:{rows[-1][0]}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+def render_page(kind: str, direction: str = "", cursor_id: int = 0) -> tuple:
+    try:
+        rows, has_older, has_newer = db_page(kind, direction, cursor_id)
     except Exception as e:
         logging.error(f"DB error: {e}")
-        return f"Ошибка БД: {str(e)[:150]}"
+        note_error(e)
+        return f"Ошибка БД: {str(e)[:150]}", None
+    if not rows:
+        return "Нет данных", None
+    text = "\n".join(f"{row_id}. {value}" for row_id, value in rows)
+    return text, page_markup(kind, rows, has_older, has_newer)
 
 async def get_emails(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Еmail из БД")
-    query = "SELECT email FROM emails ORDER BY id DESC LIMIT 20;"
-    out = await asyncio.to_thread(db_query, query)
-    await update.message.reply_text(out)
+    page = await run_scheduled(update, command_key(update), render_page, "emails")
+    if page is not None:
+        await update.message.reply_text(page[0], reply_markup=page[1])
 
 async def get_phone_numbers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Номера телефонов из БД")
-    query = "SELECT phone FROM phone_numbers ORDER BY id DESC LIMIT 20;"
-    out = await asyncio.to_thread(db_query, query)
-    await update.message.reply_text(out)
+    page = await run_scheduled(update, command_key(update), render_page, "phones")
+    if page is not None:
+        await update.message.reply_text(page[0], reply_markup=page[1])
+
+async def handle_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    _, kind, direction, cursor_id = query.data.split(":")
+    if kind not in DB_TABLES:
+        return
+    page = await run_scheduled(update, "page", render_page, kind, direction, int(cursor_id))
+    if page is not None:
+        await query.edit_message_text(page[0], reply_markup=page[1])
+
+@timed("db", "db")
+def db_export(kind: str, path: str) -> int:
+    table, column = DB_TABLES[kind]
+    query = sql.SQL("SELECT id, {col} FROM {tbl} ORDER BY id;").format(
+        col=sql.Identifier(column), tbl=sql.Identifier(table)
+    )
+    count = 0
+    with get_db_pool().connection() as conn:
+        with conn.cursor(name=f"export_{kind}") as cur, gzip.open(path, "wt", newline="", encoding="utf-8") as f:
+            cur.itersize = DB_EXPORT_ITERSIZE
+            cur.execute(query)
+            writer = csv.writer(f)
+            writer.writerow(["id", column])
+            for row in cur:
+                writer.writerow(row)
+                count += 1
+        conn.rollback()
+    return count
+
+async def export_table(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if len(context.args) != 1 or context.args[0] not in DB_TABLES:
+        await update.message.reply_text(f"Использование: /export <{'|'.join(DB_TABLES)}>")
+        return
+    kind = context.args[0]
+    await update.message.reply_text("Готовлю выгрузку")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"{kind}.csv.gz")
+        try:
+            count = await run_scheduled(update, "export", db_export, kind, path)
+        except Exception as e:
+            logging.error(f"DB export error: {e}")
+            note_error(e)
+            await update.message.reply_text(f"Ошибка БД: {str(e)[:150]}")
+            return
+        if count is None:
+            return
+        with open(path, "rb") as f:
+            await update.message.reply_document(f, filename=f"{kind}.csv.gz", caption=f"Строк: {count}")
 
+def bulk_insert(cur, table: str, column: str, values: list) -> int:
+    unique = list(dict.fromkeys(values))
+    if not unique:
+        return 0
+    query = sql.SQL("INSERT INTO {} ({}) VALUES %s ON CONFLICT DO NOTHING RETURNING 1").format(
+        sql.Identifier(table), sql.Identifier(column)
+    )
+    rows = execute_values(cur, query, [(v,) for v in unique], page_size=DB_BATCH_SIZE, fetch=True)
+    return len(rows)
+
+@timed("db", "db")
 def db_insert_emails(emails: list) -> str:
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            database=os.getenv("DB_DATABASE"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD")
-        )
-        cur = conn.cursor()
-        for email in emails:
-            cur.execute("INSERT INTO emails (email) VALUES (%s) ON CONFLICT DO NOTHING;", (email,))
-        conn.commit()
-        cur.close()
-        conn.close()
-        return f"Успешно сохранено {len(emails)} email"
+        with get_db_pool().connection() as conn:
+            with conn.cursor() as cur:
+                inserted = bulk_insert(cur, "emails", "email", emails)
+            conn.commit()
+        return f"Успешно сохранено {inserted} email, пропущено {len(emails) - inserted} (повторы или уже в базе)"
     except Exception as e:
         logging.error(f"DB insert error: {e}")
+        TELEMETRY.error("db", "db_insert_emails")
+        note_error(e)
         return f"Ошибка записи email: {str(e)[:150]}"
 
+@timed("db", "db")
 def db_insert_phones(phones: list) -> str:
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            database=os.getenv("DB_DATABASE"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD")
-        )
-        cur = conn.cursor()
-        for phone in phones:
-            cur.execute("INSERT INTO phone_numbers (phone) VALUES (%s) ON CONFLICT DO NOTHING;", (phone,))
-        conn.commit()
-        cur.close()
-        conn.close()
-        return f"Успешно сохранено {len(phones)} номеров"
+        with get_db_pool().connection() as conn:
+            with conn.cursor() as cur:
+                inserted = bulk_insert(cur, "phone_numbers", "phone", phones)
+            conn.commit()
+        return f"Успешно сохранено {inserted} номеров, пропущено {len(phones) - inserted} (повторы или уже в базе)"
     except Exception as e:
         logging.error(f"DB insert error: {e}")
+        TELEMETRY.error("db", "db_insert_phones")
+        note_error(e)
         return f"Ошибка записи номеров: {str(e)[:150]}"
 
+async def db_pool_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if DB_POOL is None:
+        await update.message.reply_text("Пул соединений БД не создан")
+        return
+    stats = DB_POOL.snapshot()
+    await update.message.reply_text(
+        f"Соединений: {stats['size']} из {stats['max']} (свободно {stats['idle']}, занято {stats['in_use']})\n"
+        f"Выдано: {stats['acquired']}\n"
+        f"Ожиданий: {stats['waited']}\n"
+        f"Отказов (пул исчерпан): {stats['exhausted']}\n"
+        f"Заменено нерабочих: {stats['replaced']}"
+    )
 
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    return web.Response(text=TELEMETRY.render(), content_type="text/plain")
 
+async def start_metrics_server() -> web.AppRunner:
+    server = web.Application()
+    server.router.add_get("/metrics", metrics_endpoint)
+    runner = web.AppRunner(server)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_LISTEN, METRICS_PORT).start()
+    return runner
 
-def main():
-    token = os.getenv("TOKEN")
-    if not token:
-        raise ValueError("TOKEN не найден в .env")
+async def bot_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("Команда доступна только администраторам")
+        return
+    with TELEMETRY.lock:
+        latency = sorted(TELEMETRY.latency.items(), key=lambda item: -item[1].count)
+        errors = dict(TELEMETRY.errors)
+        inflight = sum(n for (kind, _), n in TELEMETRY.inflight.items() if kind == "handler")
+        lines = [
+            f"{kind}/{name}: {h.count} шт, p50 ≤ {h.quantile(0.5):g} с, p99 ≤ {h.quantile(0.99):g} с, "
+            f"ошибок {errors.get((kind, name), 0)}"
+            for (kind, name), h in latency[:20]
+        ]
+    lines.append(f"\nВ обработке: {inflight}, у планировщика: {SCHEDULER.running}, в очереди: {SCHEDULER.waiting()}")
+    for page in paginate("\n".join(lines)):
+        await update.message.reply_text(page)
 
-    required = ["RM_HOST", "RM_PORT", "RM_USER", "RM_PASSWORD"]
-    for var in required:
-        if not os.getenv(var):
-            logging.warning(f"Переменная {var} отсутствует в .env")
+async def post_init(app: Application):
+    app.bot_data['metrics_task'] = asyncio.create_task(metrics_sampler(app))
+    app.bot_data['repl_task'] = asyncio.create_task(repl_watcher(app))
+    JOURNAL.start()
+    if METRICS_PORT:
+        try:
+            app.bot_data['metrics_server'] = await start_metrics_server()
+        except OSError as e:
+            logging.error(f"Metrics endpoint error: {e}")
+
+async def post_shutdown(app: Application):
+    for name in ('metrics_task', 'repl_task'):
+        task = app.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+    runner = app.bot_data.pop('metrics_server', None)
+    if runner:
+        await runner.cleanup()
+    ssh_reset()
+    if DB_POOL is not None:
+        DB_POOL.close()
+    if BREACH_INDEX is not None:
+        BREACH_INDEX.close()
+    await asyncio.to_thread(JOURNAL.stop)
+
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 32))
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+async def webhook_update(request: web.Request) -> web.Response:
+    app = request.app["bot_app"]
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    if not isinstance(data, dict):
+        return web.Response(status=400)
+    try:
+        update = Update.de_json(data, app.bot)
+    except Exception as e:
+        # de_json падает на объектах неверной формы разными исключениями
+        logging.warning(f"Webhook: rejected update: {e!r}")
+        return web.Response(status=400)
+    await app.update_queue.put(update)
+    return web.Response()
+
+async def webhook_health(request: web.Request) -> web.Response:
+    app = request.app["bot_app"]
+    return web.json_response({"running": app.running, "queued": app.update_queue.qsize()})
 
-    app = Application.builder().token(token).build()
+async def run_webhook(app: Application, stop: asyncio.Event = None):
+    # Обновления принимает любой, кто умеет слать POST на WEBHOOK_PATH:
+    # Telegram (если задан WEBHOOK_URL) или локальный генератор нагрузки.
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    server = web.Application()
+    server["bot_app"] = app
+    server.router.add_post(WEBHOOK_PATH, webhook_update)
+    server.router.add_get("/healthz", webhook_health)
+    runner = web.AppRunner(server)
+
+    try:
+        await app.initialize()
+        await post_init(app)
+        await app.start()
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+        if WEBHOOK_URL:
+            await app.bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES
+            )
+        logging.info(f"Webhook server listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await stop.wait()
+    finally:
+        # сначала перестаем принимать запросы, затем дорабатываем очередь;
+        # при ошибке запуска сворачиваем только то, что успело подняться
+        await runner.cleanup()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        await post_shutdown(app)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+
+def build_app(token: str, webhook: bool = False, request: BaseRequest = None) -> Application:
+    builder = (Application.builder().token(token)
+               .post_init(post_init).post_shutdown(post_shutdown)
+               .request(request or TimedRequest(pool_timeout=30 if webhook else 1.0)))
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL.rstrip('/')}/bot").base_file_url(f"{TELEGRAM_API_URL.rstrip('/')}/file/bot")
+    if webhook:
+        builder = builder.updater(None).concurrent_updates(WEBHOOK_CONCURRENCY)
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
@@ -300,7 +1856,7 @@ def main():
     app.add_handler(ConversationHandler(
     entry_points=[CommandHandler("find_email", find_email_start)],
     states={
-        EMAIL_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_email_input)],
+        EMAIL_INPUT: [MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.Document.ALL, handle_email_input)],
         CONFIRM_EMAIL_SAVE: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_email_save)]
     },
     fallbacks=[]
@@ -309,14 +1865,14 @@ def main():
     app.add_handler(ConversationHandler(
         entry_points=[CommandHandler("find_phone_number", find_phone_start)],
         states={
-            PHONE_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_phone_input)],
+            PHONE_INPUT: [MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.Document.ALL, handle_phone_input)],
             CONFIRM_PHONE_SAVE: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_phone_save)]
         },
         fallbacks=[]
     ))
     app.add_handler(ConversationHandler(
         entry_points=[CommandHandler("verify_password", verify_password_start)],
-        states={PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_password_input)]},
+        states={PASSWORD: [MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.Document.ALL, handle_password_input)]},
         fallbacks=[]
     ))
 
@@ -337,14 +1893,45 @@ def main():
         fallbacks=[]
     ))
     app.add_handler(CommandHandler("get_services", get_services))
+    app.add_handler(CommandHandler("trend", trend))
+    app.add_handler(CommandHandler("subscribe_alerts", subscribe_alerts))
+    app.add_handler(CommandHandler("unsubscribe_alerts", unsubscribe_alerts))
 
     app.add_handler(CommandHandler("get_repl_logs", get_repl_logs))
+    app.add_handler(CommandHandler("subscribe_repl", subscribe_repl))
+    app.add_handler(CommandHandler("unsubscribe_repl", unsubscribe_repl))
     app.add_handler(CommandHandler("get_emails", get_emails))
     app.add_handler(CommandHandler("get_phone_numbers", get_phone_numbers))
+    app.add_handler(CallbackQueryHandler(handle_page, pattern=r"^page:"))
+    app.add_handler(CommandHandler("export", export_table))
+    app.add_handler(CommandHandler("db_pool_stats", db_pool_stats))
+    app.add_handler(CommandHandler("bot_stats", bot_stats))
 
     app.add_handler(MessageHandler(filters.COMMAND, unknown))
 
-    app.run_polling()
+    for group in app.handlers.values():
+        instrument_handlers(group)
+    return app
+
+def main():
+    token = os.getenv("TOKEN")
+    if not token:
+        raise ValueError("TOKEN не найден в .env")
+
+    required = ["RM_HOST", "RM_PORT", "RM_USER", "RM_PASSWORD"]
+    for var in required:
+        if not os.getenv(var):
+            logging.warning(f"Переменная {var} отсутствует в .env")
+
+    try:
+        get_db_pool()
+    except Exception as e:
+        logging.error(f"DB pool init error: {e}")
+
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(build_app(token, webhook=True)))
+    else:
+        build_app(token).run_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,276 @@
+"""
+Нагрузочный стенд для ResearchLab: N пользователей одновременно гоняют сценарии
+через настоящий граф обработчиков бота, включая состояния ConversationHandler
+(email, телефоны, apt). Вместо внешних сервисов используются локальные подмены:
+- Bot API Telegram — ответы формируются в памяти, без сети;
+- SSH — локальный SSH-сервер на paramiko с заготовленным выводом команд;
+- PostgreSQL — временный кластер (initdb/pg_ctl) или база из .env (--use-env-db);
+  если ни того, ни другого нет, сценарии с БД пропускаются.
+Печатает p50/p99 и пропускную способность по каждой команде; запросы, отклоненные
+планировщиком или ограничением частоты, считаются отдельно и в задержки не входят.
+"""
+import os
+import json
+import time
+import random
+import socket
+import shutil
+import asyncio
+import argparse
+import tempfile
+import itertools
+import threading
+import subprocess
+
+import paramiko
+import psycopg2
+from telegram import Update
+from telegram.request import BaseRequest
+
+import ResearchLab as bot
+from benchutil import make_update, percentile
+from loadgen import FakeTelegram
+
+SCENARIOS = {
+    "start": ["/start"],
+    "uptime": ["/get_uptime"],
+    "ps": ["/get_ps"],
+    "apt": ["/get_apt_list", "all"],
+    "password": ["/verify_password", "Qwerty!123"],
+    "trend": ["/trend load 1h"],
+    "find_email": ["/find_email", "пишите на a{n}@example.com или b{n}@mail.ru", "y"],
+    "find_phone": ["/find_phone_number", "звоните +7 (916) 123-{n:04d} или 8 800 555 35 35", "y"],
+    "emails": ["/get_emails"],
+    "phones": ["/get_phone_numbers"],
+}
+DB_SCENARIOS = {"find_email", "find_phone", "emails", "phones"}
+
+class LocalBotApi(BaseRequest):
+    """Bot API в памяти: вызовы бота сразу уходят в FakeTelegram из loadgen, без HTTP"""
+    def __init__(self):
+        self.fake = FakeTelegram()
+        self.sent = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        params = request_data.parameters if request_data else {}
+        api_method = url.rsplit("/", 1)[-1]
+        if api_method == "sendMessage":
+            self.sent.setdefault(int(params["chat_id"]), []).append(params.get("text", ""))
+        result = self.fake.reply(api_method, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+def fake_output(command):
+    """Заготовленный вывод для команд, которые бот выполняет на хосте"""
+    if command.startswith("dpkg -l"):
+        return "".join(f"ii  package{i:05d}  1.0.{i}  amd64  Synthetic package {i}\n" for i in range(3000))
+    if command.startswith("ps aux"):
+        return "".join(f"root {i} 0.0 0.1 1000 500 ? S 10:00 0:00 /usr/bin/proc{i}\n" for i in range(400))
+    if "/proc/loadavg" in command:
+        return ("0.42 0.35 0.30 1/300 1234\nMemTotal: 2048000 kB\nMemAvailable: 1024000 kB\n"
+                "cpu  100 0 100 700 100 0 0 0 0 0\n/dev/sda1 100 50 50 50% /\n")
+    return f"fake output for: {command}\n"
+
+class FakeSshServer(paramiko.ServerInterface):
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OPEN_REQUEST
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.respond, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    def respond(self, channel, command):
+        time.sleep(self.latency)
+        channel.sendall(fake_output(command).encode())
+        channel.send_exit_status(0)
+        channel.shutdown_write()
+        channel.close()
+
+def start_ssh_server(latency):
+    """Локальный SSH-сервер; возвращает порт"""
+    host_key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(100)
+
+    def serve():
+        while True:
+            sock, _ = listener.accept()
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(host_key)
+            transport.start_server(server=FakeSshServer(latency))
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+def find_pg_bin():
+    if shutil.which("initdb"):
+        return os.path.dirname(shutil.which("initdb"))
+    if shutil.which("pg_config"):
+        return subprocess.run(["pg_config", "--bindir"], capture_output=True, text=True).stdout.strip()
+    return None
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_postgres(tmp):
+    """Временный кластер PostgreSQL; возвращает функцию остановки или None"""
+    bindir = find_pg_bin()
+    if not bindir or not os.path.exists(os.path.join(bindir, "initdb")):
+        return None
+    data = os.path.join(tmp, "pgdata")
+    port = free_port()
+    subprocess.run([os.path.join(bindir, "initdb"), "-D", data, "-U", "bench", "--auth=trust"],
+                   check=True, capture_output=True)
+    subprocess.run([os.path.join(bindir, "pg_ctl"), "-D", data, "-w", "-l", os.path.join(tmp, "pg.log"),
+                    "-o", f"-p {port} -k {tmp} -c listen_addresses=''", "start"],
+                   check=True, capture_output=True)
+    os.environ.update(DB_HOST=tmp, DB_PORT=str(port), DB_USER="bench", DB_PASSWORD="", DB_DATABASE="postgres")
+    return lambda: subprocess.run([os.path.join(bindir, "pg_ctl"), "-D", data, "-m", "fast", "stop"],
+                                  capture_output=True)
+
+def prepare_db():
+    """Создает таблицы, если их нет; False — база недоступна"""
+    try:
+        conn = psycopg2.connect(
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            database=os.getenv("DB_DATABASE"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD")
+        )
+    except psycopg2.Error as e:
+        print(f"PostgreSQL недоступен: {str(e).strip()}")
+        return False
+    with conn, conn.cursor() as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS emails (id SERIAL PRIMARY KEY, email TEXT UNIQUE);")
+        cur.execute("CREATE TABLE IF NOT EXISTS phone_numbers (id SERIAL PRIMARY KEY, phone TEXT UNIQUE);")
+    conn.close()
+    return True
+
+def outcome(texts):
+    """Исход обновления по ответам бота: отказ планировщика, ограничение частоты или обработано"""
+    if any(t.startswith(bot.OVERLOADED_TEXT) for t in texts):
+        return "shed"
+    if any(t.startswith(bot.RATE_LIMITED_TEXT) for t in texts):
+        return "limited"
+    return "ok"
+
+async def run_user(app, api, user_id, scenarios, iterations, update_ids, results):
+    for n in range(iterations):
+        name = random.choice(scenarios)
+        for step, text in enumerate(SCENARIOS[name]):
+            text = text.format(n=user_id * 1000 + n)
+            key = text.split()[0] if step == 0 else f"{name}:{step}"
+            update = Update.de_json(make_update(next(update_ids), user_id, text), app.bot)
+            started = time.perf_counter()
+            await app.process_update(update)
+            elapsed = time.perf_counter() - started
+            texts = api.sent.pop(user_id, [])
+            stats = results.setdefault(key, {"ok": [], "shed": 0, "limited": 0, "queued": 0})
+            stats["queued"] += any(t.startswith(bot.QUEUED_TEXT) for t in texts)
+            result = outcome(texts)
+            if result != "ok":
+                # отказ в середине сценария завершает диалог, остальные шаги не отправляем
+                stats[result] += 1
+                break
+            stats["ok"].append(elapsed)
+
+async def run(args, scenarios):
+    api = LocalBotApi()
+    app = bot.build_app("123456:bench", request=api)
+    await app.initialize()
+    results = {}
+    update_ids = itertools.count(1)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_user(app, api, 200000 + u, scenarios, args.iterations, update_ids, results)
+        for u in range(args.users)
+    ))
+    elapsed = time.perf_counter() - started
+    await app.shutdown()
+
+    total = sum(len(v["ok"]) + v["shed"] + v["limited"] for v in results.values())
+    print(f"Пользователей: {args.users}, итераций: {args.iterations}, обновлений: {total}, "
+          f"время: {elapsed:.2f} с, {total / elapsed:.0f} обн/с, вызовов Bot API: {api.fake.calls}")
+    print(f"Планировщик: {bot.SCHEDULER.workers} исполнителей, очередь до {bot.SCHEDULER.max_queue}")
+    print("Задержки считаются только по обработанным запросам; отказы и ограничения — отдельно")
+    print(f"{'команда':<22} {'успешно':>8} {'отказ':>6} {'лимит':>6} {'в очереди':>10} "
+          f"{'p50, мс':>9} {'p99, мс':>9} {'обн/с':>8}")
+    for key, stats in sorted(results.items()):
+        ok = stats["ok"]
+        print(f"{key:<22} {len(ok):>8} {stats['shed']:>6} {stats['limited']:>6} {stats['queued']:>10} "
+              f"{percentile(ok, 0.5) * 1000:>9.1f} {percentile(ok, 0.99) * 1000:>9.1f} {len(ok) / elapsed:>8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный стенд для бота')
+    parser.add_argument('--users', type=int, default=50, help='Одновременных пользователей')
+    parser.add_argument('--iterations', type=int, default=10, help='Сценариев на пользователя')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS),
+                        help='Какие сценарии запускать')
+    parser.add_argument('--ssh-latency', type=float, default=0.02, help='Задержка выполнения команды на SSH-сервере, с')
+    parser.add_argument('--use-env-db', action='store_true', help='Использовать базу из .env вместо временной')
+    parser.add_argument('--keep-limits', action='store_true', help='Не отключать ограничения частоты запросов')
+    parser.add_argument('--sched-workers', type=int, default=bot.SCHED_WORKERS,
+                        help='Одновременных тяжелых заданий в планировщике бота')
+    parser.add_argument('--sched-queue', type=int, default=bot.SCHED_QUEUE,
+                        help='Длина очереди планировщика; сверх нее запросы отклоняются')
+    args = parser.parse_args()
+
+    bot.SCHEDULER.workers = args.sched_workers
+    bot.SCHEDULER.max_queue = args.sched_queue
+
+    if not args.keep_limits:
+        bot.USER_LIMIT = (1e9, 10 ** 9)
+        bot.COMMAND_LIMITS = {p: (1e9, 10 ** 9) for p in bot.COMMAND_LIMITS}
+
+    ssh_port = start_ssh_server(args.ssh_latency)
+    os.environ.update(RM_HOST="127.0.0.1", RM_PORT=str(ssh_port), RM_USER="bench", RM_PASSWORD="bench")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stop_pg = None if args.use_env_db else start_postgres(tmp)
+        try:
+            scenarios = args.scenarios
+            if not (stop_pg or args.use_env_db) or not prepare_db():
+                skipped = sorted(DB_SCENARIOS & set(scenarios))
+                if skipped:
+                    print(f"PostgreSQL не найден, сценарии с БД пропущены: {', '.join(skipped)}")
+                scenarios = [s for s in scenarios if s not in DB_SCENARIOS]
+            if not scenarios:
+                return
+            asyncio.run(run(args, scenarios))
+        finally:
+            bot.ssh_reset()
+            if bot.DB_POOL is not None:
+                bot.DB_POOL.close()
+            if stop_pg:
+                stop_pg()
+
+if __name__ == "__main__":
+    # python bench_bot.py --users 100 --iterations 20
+    # python bench_bot.py --scenarios apt ps --ssh-latency 0.1
+    # python bench_bot.py --users 200 --sched-workers 16 --sched-queue 200
+    main()
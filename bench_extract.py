@@ -0,0 +1,70 @@
+"""
+Измеряет пропускную способность (МБ/с) потокового поиска email и телефонов.
+Сравнивает однопроходный scan_file из ResearchLab с прежним способом:
+чтение файла целиком и два отдельных re.findall.
+"""
+import os
+import re
+import time
+import random
+import argparse
+import tempfile
+
+from ResearchLab import EMAIL_RE, PHONE_RE, scan_file
+
+def generate_file(path, size_mb):
+    """Создает текстовый файл заданного размера со случайными контактами"""
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "ошибка", "INFO", "GET /index.html 200"]
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        while written < target:
+            parts = random.choices(words, k=20)
+            if random.random() < 0.3:
+                parts.append(f"user{random.randint(0, 100000)}@example.com")
+            if random.random() < 0.3:
+                parts.append(f"+7 (9{random.randint(10, 99)}) {random.randint(100, 999)}-12-34")
+            line = " ".join(parts) + "\n"
+            f.write(line)
+            written += len(line.encode('utf-8'))
+
+def old_scan(path):
+    """Прежний способ: весь файл в памяти и два прохода регулярными выражениями"""
+    with open(path, encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    emails = re.findall(EMAIL_RE, text)
+    phones = re.findall(PHONE_RE, text)
+    return len(emails), len(phones)
+
+def measure(name, func, path):
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    started = time.perf_counter()
+    emails, phones = func(path)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<12} {elapsed:7.2f} с  {size_mb / elapsed:8.1f} МБ/с  email: {emails}, телефонов: {phones}")
+
+def stream_scan(path):
+    scanner = scan_file(path)
+    return scanner.found["email"], scanner.found["phone"]
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк поиска контактов в файлах')
+    parser.add_argument('--file', help='Готовый файл для проверки (иначе будет сгенерирован)')
+    parser.add_argument('--size', type=int, default=50, help='Размер генерируемого файла в МБ')
+    args = parser.parse_args()
+
+    if args.file:
+        measure("stream", stream_scan, args.file)
+        measure("old", old_scan, args.file)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sample.txt")
+        print(f"Генерация файла {args.size} МБ...")
+        generate_file(path, args.size)
+        measure("stream", stream_scan, path)
+        measure("old", old_scan, path)
+
+if __name__ == "__main__":
+    # python bench_extract.py --size 100
+    # python bench_extract.py --file /var/log/syslog
+    main()
@@ -0,0 +1,67 @@
+"""
+Сравнивает скорость сохранения email в PostgreSQL:
+построчный INSERT (как было раньше) против пакетного bulk_insert из ResearchLab.
+Работает во временной таблице, реальные данные бота не затрагиваются.
+"""
+import os
+import time
+import random
+import argparse
+
+import psycopg2
+
+from ResearchLab import bulk_insert
+
+def make_emails(count, duplicates):
+    """Генерирует список email, часть из которых повторяется"""
+    unique = [f"user{i}@example.com" for i in range(count - int(count * duplicates))]
+    emails = unique + random.choices(unique, k=count - len(unique))
+    random.shuffle(emails)
+    return emails
+
+def reset_table(cur):
+    cur.execute("DROP TABLE IF EXISTS bench_emails;")
+    cur.execute("CREATE TEMP TABLE bench_emails (id SERIAL PRIMARY KEY, email TEXT UNIQUE);")
+
+def insert_per_row(cur, emails):
+    """Старый способ: один запрос на каждую строку"""
+    inserted = 0
+    for email in emails:
+        cur.execute("INSERT INTO bench_emails (email) VALUES (%s) ON CONFLICT DO NOTHING;", (email,))
+        inserted += cur.rowcount
+    return inserted
+
+def run(conn, name, func, emails):
+    with conn.cursor() as cur:
+        reset_table(cur)
+        started = time.perf_counter()
+        inserted = func(cur, emails)
+        conn.commit()
+        elapsed = time.perf_counter() - started
+    print(f"{name:<10} {elapsed:8.3f} с  {len(emails) / elapsed:10.0f} строк/с  "
+          f"сохранено {inserted}, пропущено {len(emails) - inserted}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк сохранения email в PostgreSQL')
+    parser.add_argument('--count', type=int, default=10000, help='Количество email в пакете')
+    parser.add_argument('--duplicates', type=float, default=0.1, help='Доля повторов в пакете (0..1)')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        database=os.getenv("DB_DATABASE"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD")
+    )
+    emails = make_emails(args.count, args.duplicates)
+    print(f"Email в пакете: {len(emails)}, уникальных: {len(set(emails))}")
+    try:
+        run(conn, "per-row", insert_per_row, emails)
+        run(conn, "bulk", lambda cur, values: bulk_insert(cur, "bench_emails", "email", values), emails)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    # python bench_insert.py --count 50000 --duplicates 0.2
+    main()
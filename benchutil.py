@@ -0,0 +1,23 @@
+"""
+Общие помощники для стендов нагрузки и отчетов: фиктивные обновления Telegram и перцентили.
+"""
+import time
+
+def make_update(update_id, user_id, text):
+    """Обновление Telegram с текстовым сообщением от пользователя user_id в личном чате"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
@@ -0,0 +1,149 @@
+"""
+Быстрые ответы по журналу запросов бота (bot_journal.jsonl).
+Текущий файл открывается через mmap, начало нужного периода ищется двоичным поиском
+по полю "ts" в начале каждой строки, дальше читаются только строки за период.
+Архивы после ротации (.1.gz, .2.gz, ...) читаются потоком и только если период
+в них заходит. Строки без "ts" и "duration_ms" пропускаются.
+Пример: самые медленные команды за сегодня.
+"""
+import os
+import re
+import gzip
+import json
+import mmap
+import argparse
+from datetime import datetime, timedelta
+
+from benchutil import percentile
+
+TS_RE = re.compile(rb'\{"ts": ([0-9.]+)')
+
+def line_ts(mm, pos):
+    """Время записи из строки, начинающейся с pos (или None для битой строки)"""
+    m = TS_RE.match(mm, pos)
+    return float(m.group(1)) if m else None
+
+def next_line(mm, pos):
+    """Начало строки, следующей за позицией pos"""
+    end = mm.find(b"\n", pos)
+    return len(mm) if end < 0 else end + 1
+
+def find_start(mm, since):
+    """Двоичный поиск первой строки с ts >= since; строки записаны по возрастанию времени"""
+    lo, hi = 0, len(mm)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        pos = next_line(mm, mid - 1) if mid else 0
+        if pos >= hi:
+            hi = mid
+            continue
+        ts = line_ts(mm, pos)
+        if ts is not None and ts < since:
+            lo = next_line(mm, pos)
+        else:
+            hi = pos
+    return lo
+
+def parse_entry(line, since):
+    """Запись журнала из строки или None для чужих, битых и более ранних строк"""
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(entry, dict) or not isinstance(entry.get("ts"), (int, float)) or "duration_ms" not in entry:
+        return None
+    return entry if entry["ts"] >= since else None
+
+def read_current(path, since):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = find_start(mm, since)
+            while pos < len(mm):
+                end = next_line(mm, pos)
+                entry = parse_entry(mm[pos:end], since)
+                if entry is not None:
+                    yield entry
+                pos = end
+
+def read_archive(path, since):
+    with gzip.open(path, 'rb') as f:
+        for line in f:
+            ts = line_ts(line, 0)
+            if ts is not None and ts >= since:
+                entry = parse_entry(line, since)
+                if entry is not None:
+                    yield entry
+
+def journal_files(path):
+    """Текущий файл и архивы от новых к старым"""
+    files = [path] if os.path.exists(path) else []
+    i = 1
+    while os.path.exists(f"{path}.{i}.gz"):
+        files.append(f"{path}.{i}.gz")
+        i += 1
+    return files
+
+def first_ts(path):
+    with (gzip.open if path.endswith(".gz") else open)(path, 'rb') as f:
+        return line_ts(f.readline(), 0)
+
+def read_entries(path, since):
+    # Файлы идут по времени: как только первая запись файла раньше since,
+    # более старые архивы периода уже не содержат.
+    needed = []
+    for name in journal_files(path):
+        needed.append(name)
+        ts = first_ts(name)
+        if ts is not None and ts < since:
+            break
+    for name in reversed(needed):
+        yield from (read_archive if name.endswith(".gz") else read_current)(name, since)
+
+def slowest_commands(entries, top):
+    """Сводка по командам, отсортированная по p99"""
+    by_command = {}
+    slowest = []
+    for e in entries:
+        if "duration_ms" not in e:
+            continue
+        by_command.setdefault(e.get("command"), []).append(e["duration_ms"])
+        slowest.append((e["duration_ms"], e))
+    slowest.sort(key=lambda item: -item[0])
+    summary = sorted(
+        ((cmd, len(d), percentile(d, 0.5), percentile(d, 0.99), max(d)) for cmd, d in by_command.items()),
+        key=lambda row: -row[3]
+    )
+    return summary[:top], [e for _, e in slowest[:top]]
+
+def main():
+    parser = argparse.ArgumentParser(description='Запросы к журналу запросов бота')
+    parser.add_argument('--file', default=os.getenv("JOURNAL_PATH", "bot_journal.jsonl"), help='Файл журнала')
+    parser.add_argument('--hours', type=float, help='Период в часах (по умолчанию — с начала сегодняшнего дня)')
+    parser.add_argument('--top', type=int, default=10, help='Сколько строк выводить')
+    args = parser.parse_args()
+
+    if args.hours:
+        since = datetime.now() - timedelta(hours=args.hours)
+    else:
+        since = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    summary, slowest = slowest_commands(read_entries(args.file, since.timestamp()), args.top)
+    if not summary:
+        print("Записей за период нет")
+        return
+
+    print(f"Команды с {since:%Y-%m-%d %H:%M} (по p99):")
+    print(f"{'команда':<20} {'кол-во':>8} {'p50, мс':>10} {'p99, мс':>10} {'max, мс':>10}")
+    for cmd, count, p50, p99, worst in summary:
+        print(f"{str(cmd):<20} {count:>8} {p50:>10.1f} {p99:>10.1f} {worst:>10.1f}")
+    print("\nСамые медленные запросы:")
+    for e in slowest:
+        when = datetime.fromtimestamp(e["ts"]).strftime('%H:%M:%S')
+        error = f"  ошибка: {e['error']}" if e.get("error") else ""
+        print(f"{when}  {e['duration_ms']:>9.1f} мс  {e.get('command')}  user={e.get('user')}{error}")
+
+if __name__ == "__main__":
+    # python journal_query.py
+    # python journal_query.py --hours 1 --top 5
+    main()
@@ -0,0 +1,136 @@
+"""
+Генератор нагрузки для webhook-режима бота.
+Поднимает бота из ResearchLab в режиме webhook и поддельный Bot API Telegram,
+отправляет на webhook пачку фиктивных обновлений и меряет пропускную способность
+и задержку до первого ответа бота. Настоящий Telegram не нужен.
+"""
+import time
+import asyncio
+import argparse
+import itertools
+
+import aiohttp
+from aiohttp import web
+
+import ResearchLab as bot
+from benchutil import make_update, percentile
+
+class FakeTelegram:
+    """Минимальный Bot API: отвечает на вызовы бота и запоминает время ответов"""
+    def __init__(self):
+        self.replies = {}
+        self.calls = 0
+        self.message_ids = itertools.count(1)
+        self.changed = asyncio.Event()
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def reply(self, method, data):
+        """Результат вызова Bot API; для сообщений запоминает время первого ответа в чат"""
+        self.calls += 1
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "loadgen", "username": "loadgen_bot"}
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(data.get("chat_id", 0))
+            self.replies.setdefault(chat_id, time.perf_counter())
+            self.changed.set()
+            return {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": str(data.get("text", "")),
+            }
+        return True
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            data = await request.json()
+        else:
+            data = await request.post()
+        return web.json_response({"ok": True, "result": self.reply(method, data)})
+
+    async def wait_for(self, chats, timeout):
+        deadline = time.perf_counter() + timeout
+        while not chats.issubset(self.replies) and time.perf_counter() < deadline:
+            self.changed.clear()
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout=0.5)
+            except asyncio.TimeoutError:
+                pass
+
+async def wait_ready(session, url, timeout=10):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("Webhook-сервер не запустился")
+
+async def run(args):
+    fake = FakeTelegram()
+    api_runner = web.AppRunner(fake.make_app())
+    await api_runner.setup()
+    await web.TCPSite(api_runner, "127.0.0.1", args.api_port).start()
+
+    bot.TELEGRAM_API_URL = f"http://127.0.0.1:{args.api_port}"
+    bot.WEBHOOK_PORT = args.port
+    bot.WEBHOOK_CONCURRENCY = args.bot_concurrency
+    stop = asyncio.Event()
+    server = asyncio.create_task(bot.run_webhook(bot.build_app("123456:loadgen", webhook=True), stop))
+
+    base = f"http://{bot.WEBHOOK_LISTEN}:{args.port}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": bot.WEBHOOK_SECRET} if bot.WEBHOOK_SECRET else {}
+    sent = {}
+    limit = asyncio.Semaphore(args.concurrency)
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_ready(session, base + "/healthz")
+
+            async def post(i):
+                user_id = 100000 + i
+                text = args.commands[i % len(args.commands)]
+                async with limit:
+                    sent[user_id] = time.perf_counter()
+                    async with session.post(base + bot.WEBHOOK_PATH, json=make_update(i + 1, user_id, text), headers=headers) as resp:
+                        resp.raise_for_status()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(post(i) for i in range(args.updates)))
+            accepted = time.perf_counter() - started
+            await fake.wait_for(set(sent), args.timeout)
+            finished = time.perf_counter() - started
+    finally:
+        stop.set()
+        await server
+        await api_runner.cleanup()
+
+    latencies = [(fake.replies[c] - t) * 1000 for c, t in sent.items() if c in fake.replies]
+    print(f"Обновлений: {args.updates}, параллельно: {args.concurrency}, команды: {', '.join(args.commands)}")
+    print(f"Приём webhook: {accepted:.2f} с ({args.updates / accepted:.0f} обн/с)")
+    print(f"С ответами:    {finished:.2f} с ({len(latencies) / finished:.0f} обн/с), без ответа: {args.updates - len(latencies)}")
+    print(f"Задержка до первого ответа: p50 {percentile(latencies, 0.5):.1f} мс, p99 {percentile(latencies, 0.99):.1f} мс")
+    print(f"Вызовов Bot API: {fake.calls}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор нагрузки для webhook-режима бота')
+    parser.add_argument('--updates', type=int, default=1000, help='Сколько обновлений отправить')
+    parser.add_argument('--concurrency', type=int, default=50, help='Одновременных POST-запросов')
+    parser.add_argument('--bot-concurrency', type=int, default=bot.WEBHOOK_CONCURRENCY, help='Параллельная обработка в боте')
+    parser.add_argument('--commands', nargs='+', default=['/start', '/help', '/trend load 1h'], help='Команды по кругу')
+    parser.add_argument('--port', type=int, default=bot.WEBHOOK_PORT, help='Порт webhook-сервера бота')
+    parser.add_argument('--api-port', type=int, default=8081, help='Порт поддельного Bot API')
+    parser.add_argument('--timeout', type=float, default=30, help='Сколько ждать ответов, с')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    # python loadgen.py --updates 5000 --concurrency 100
+    main()
@@ -0,0 +1,164 @@
+"""
+Проверки чистых функций и классов ResearchLab, не требующих SSH, БД и Telegram.
+Запуск: python -m unittest test_helpers
+"""
+import os
+import gzip
+import random
+import hashlib
+import tempfile
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+import ResearchLab as bot
+
+class SshOutputTest(unittest.TestCase):
+    def test_stderr_shown_with_stdout(self):
+        out = bot.SshOutput()
+        out.write(b"result\n")
+        out.write_err(b"warning\n")
+        self.assertEqual(out.text(), "result\n\n[stderr]\nwarning")
+
+    def test_long_stderr_is_cut_on_char_boundary_with_note(self):
+        out = bot.SshOutput()
+        data = ("ошибка " * 1000).encode()
+        out.write_err(data)
+        self.assertLessEqual(len(out.stderr), bot.SSH_STDERR_LIMIT)
+        bytes(out.stderr).decode("utf-8")
+        self.assertIn(f"из {len(data)} байт]", out.text())
+
+    def test_stderr_goes_into_spill_file(self):
+        out = bot.SshOutput(limit=10)
+        out.write(b"x" * 50)
+        out.write_err(b"disk error\n")
+        out.close()
+        try:
+            with gzip.open(out.spill_path) as f:
+                self.assertTrue(f.read().endswith(b"[stderr]\ndisk error\n"))
+        finally:
+            out.cleanup()
+
+class ContactScannerTest(unittest.TestCase):
+    def sample(self):
+        random.seed(7)
+        words = ["текст", "lorem", "ipsum", "почта:", "звонить", "—"]
+        parts = []
+        for i in range(400):
+            parts.extend(random.choices(words, k=5))
+            if i % 3 == 0:
+                parts.append(f"user{i}@example.com")
+            if i % 4 == 0:
+                parts.append(f"+7 (9{i % 90 + 10}) {i % 900 + 100}-12-34")
+            if i % 5 == 0:
+                parts.append(f"8 800 555 {i % 90 + 10} 35")
+        return " ".join(parts)
+
+    def assert_same(self, scanner, expected):
+        self.assertEqual(list(scanner.emails), list(expected.emails))
+        self.assertEqual(list(scanner.phones), list(expected.phones))
+        self.assertEqual(scanner.found, expected.found)
+
+    def test_chunk_boundaries_do_not_change_result(self):
+        text = self.sample()
+        expected = bot.scan_text(text)
+        self.assertGreater(expected.found["email"], 100)
+        for size in (1, 7, 100, 1023, 1500, 4096):
+            scanner = bot.ContactScanner()
+            for i in range(0, len(text), size):
+                scanner.feed(text[i:i + size])
+            self.assert_same(scanner.finish(), expected)
+
+    def test_scan_file_splits_multibyte_chars(self):
+        text = self.sample()
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", delete=False) as f:
+            f.write(text)
+        try:
+            for size in (3, 1000):
+                scanner = bot.scan_file(f.name, chunk_size=size)
+                self.assert_same(scanner, bot.scan_text(text))
+                self.assertEqual(scanner.bytes, len(text.encode("utf-8")))
+        finally:
+            os.unlink(f.name)
+
+class BreachIndexTest(unittest.TestCase):
+    def make_index(self, content):
+        f = tempfile.NamedTemporaryFile("wb", delete=False)
+        f.write(content)
+        f.close()
+        self.addCleanup(os.unlink, f.name)
+        index = bot.BreachIndex(f.name)
+        self.addCleanup(index.close)
+        return index
+
+    def test_lookup_hash(self):
+        digests = sorted(hashlib.sha1(str(i).encode()).hexdigest().upper() for i in range(1000))
+        index = self.make_index("".join(f"{d}:{n + 1}\r\n" for n, d in enumerate(digests)).encode())
+        for n, d in enumerate(digests):
+            self.assertEqual(index.lookup_hash(d.encode()), n + 1)
+        self.assertEqual(index.lookup_hash(b"0" * 40), 0)
+        self.assertEqual(index.lookup_hash(b"F" * 40), 0)
+        self.assertEqual(index.lookup("1"), digests.index(hashlib.sha1(b"1").hexdigest().upper()) + 1)
+        self.assertEqual(index.lookup("not in the list"), 0)
+
+    def test_last_line_without_newline_and_empty_file(self):
+        digest = hashlib.sha1(b"x").hexdigest().upper().encode()
+        self.assertEqual(self.make_index(digest + b":7").lookup_hash(digest), 7)
+        self.assertEqual(self.make_index(b"").lookup_hash(digest), 0)
+
+class FakeTable:
+    """Таблица id 1..size, отвечающая на запросы db_page по тексту условия"""
+    def __init__(self, size):
+        self.ids = list(range(1, size + 1))
+        self.rows = []
+
+    def execute(self, query, params):
+        text = repr(query)
+        if "id > %s" in text:
+            ids = [i for i in self.ids if i > params[0]]
+        elif "id < %s" in text:
+            ids = [i for i in reversed(self.ids) if i < params[0]]
+        else:
+            ids = list(reversed(self.ids))
+        self.rows = [(i, f"user{i}@example.com") for i in ids[:params[-1]]]
+
+    def fetchall(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class FakePool:
+    def __init__(self, table):
+        self.table = table
+
+    @contextmanager
+    def connection(self):
+        yield mock.Mock(cursor=lambda: self.table)
+
+class DbPageTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(bot, "get_db_pool", lambda: FakePool(FakeTable(45)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def page(self, direction="", cursor_id=0):
+        rows, has_older, has_newer = bot.db_page("emails", direction, cursor_id)
+        return [row[0] for row in rows], has_older, has_newer
+
+    def test_first_page(self):
+        self.assertEqual(self.page(), (list(range(45, 25, -1)), True, False))
+
+    def test_next_pages(self):
+        self.assertEqual(self.page("next", 26), (list(range(25, 5, -1)), True, True))
+        self.assertEqual(self.page("next", 6), ([5, 4, 3, 2, 1], False, True))
+
+    def test_prev_pages(self):
+        self.assertEqual(self.page("prev", 5), (list(range(25, 5, -1)), True, True))
+        self.assertEqual(self.page("prev", 25), (list(range(45, 25, -1)), True, False))
+
+if __name__ == "__main__":
+    unittest.main()
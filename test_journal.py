@@ -0,0 +1,113 @@
+"""
+Проверки журнала запросов из ResearchLab и поиска по нему в journal_query.
+Запуск: python -m unittest test_journal
+"""
+import os
+import json
+import mmap
+import asyncio
+import time
+import tempfile
+import unittest
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+import ResearchLab as bot
+import journal_query
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "journal.jsonl")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def stop_within(self, journal, seconds):
+        stopper = threading.Thread(target=journal.stop)
+        stopper.start()
+        stopper.join(seconds)
+        self.assertFalse(stopper.is_alive(), "Journal.stop() завис")
+
+    def test_rotate_failure_keeps_writer_alive(self):
+        journal = bot.Journal(self.path, 100, 3)
+        with mock.patch.object(bot.Journal, "_rotate", side_effect=OSError("disk full")):
+            journal.start()
+            for i in range(50):
+                journal.record({"ts": time.time(), "n": i})
+                time.sleep(0.001)
+            time.sleep(0.1)
+            self.assertTrue(journal.thread.is_alive())
+            self.stop_within(journal, 3)
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 50)
+
+    def test_unopenable_path_drops_entries_and_stops(self):
+        journal = bot.Journal(os.path.join(self.tmp.name, "missing", "journal.jsonl"), 100, 3)
+        journal.start()
+        for i in range(20):
+            journal.record({"ts": time.time(), "n": i})
+        time.sleep(0.1)
+        self.stop_within(journal, 3)
+        self.assertEqual(journal.dropped, 20)
+
+    def test_stop_with_dead_writer_does_not_hang(self):
+        journal = bot.Journal(self.path, 100, 3)
+        journal.thread = threading.Thread(target=lambda: None)
+        journal.thread.start()
+        journal.thread.join()
+        for i in range(bot.JOURNAL_QUEUE):
+            journal.record({"ts": 0, "n": i})
+        self.stop_within(journal, 3)
+
+class InstrumentTest(unittest.IsolatedAsyncioTestCase):
+    async def test_error_handled_inside_handler_is_journaled(self):
+        @bot.timed("db", "db")
+        def failing_query():
+            raise RuntimeError("connection refused")
+
+        async def handler(update, context):
+            try:
+                await asyncio.to_thread(failing_query)
+            except RuntimeError:
+                return "Ошибка БД"
+
+        update = SimpleNamespace(
+            effective_user=SimpleNamespace(id=1), effective_chat=SimpleNamespace(id=1),
+            effective_message=SimpleNamespace(text="/get_emails")
+        )
+        with mock.patch.object(bot.JOURNAL, "record") as record:
+            await bot.instrument(handler)(update, None)
+        entry = record.call_args[0][0]
+        self.assertEqual(entry["command"], "get_emails")
+        self.assertEqual(entry["error"], "RuntimeError: connection refused")
+
+class FindStartTest(unittest.TestCase):
+    def search(self, lines, since):
+        data = "".join(lines).encode()
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return data[journal_query.find_start(mm, since):].decode()
+
+    def test_finds_first_line_not_older_than_since(self):
+        lines = [json.dumps({"ts": float(ts), "duration_ms": 1.0}) + "\n" for ts in range(100)]
+        for since in (0, 1, 37.5, 99):
+            rest = self.search(lines, since)
+            self.assertEqual(rest, "".join(lines[int(since + 0.5):]))
+        self.assertEqual(self.search(lines, 1000), "")
+
+    def test_skips_foreign_lines(self):
+        lines = ['{"request_id": "x"}\n', '{"ts": 5.0, "duration_ms": 2.0}\n', '{"ts": 9.0, "duration_ms": 3.0}\n']
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            f.writelines(lines)
+        try:
+            entries = list(journal_query.read_entries(f.name, 6))
+        finally:
+            os.unlink(f.name)
+        self.assertEqual([e["ts"] for e in entries], [9.0])
+
+if __name__ == "__main__":
+    unittest.main()
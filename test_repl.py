@@ -0,0 +1,86 @@
+"""
+Проверки LogFollower из ResearchLab: скрипт слежения за логом выполняется локальным sh
+вместо SSH. Запуск: python -m unittest test_repl
+"""
+import os
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+
+import ResearchLab as bot
+
+def local_run(command, timeout=8):
+    result = subprocess.run(["sh", "-c", command], capture_output=True, text=True, timeout=timeout)
+    return result.stdout, result.stderr
+
+class LogFollowerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.tmp.name, "postgresql-main.log")
+        patches = [
+            mock.patch.object(bot, "ssh_run", local_run),
+            mock.patch.object(bot, "REPL_LOG_GLOB", os.path.join(self.tmp.name, "postgresql-*.log")),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.follower = bot.LogFollower()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def append(self, text, path=None):
+        with open(path or self.log, "a") as f:
+            f.write(text)
+
+    def test_no_log(self):
+        self.assertEqual(self.follower.poll(), (None, [], 0))
+
+    def test_first_poll_searches_whole_file(self):
+        self.append("LOG: started streaming replication\n")
+        self.append("LOG: checkpoint complete\n" * 80000)
+        path, lines, total = self.follower.poll()
+        self.assertEqual(path, self.log)
+        self.assertEqual(lines, ["LOG: started streaming replication"])
+        self.assertEqual(total, 1)
+        self.assertEqual(self.follower.poll()[1], [])
+
+    def test_partial_line_is_read_when_complete(self):
+        self.append("noise\nLOG: repli")
+        self.assertEqual(self.follower.poll()[1], [])
+        self.assertEqual(self.follower.offset, len("noise\n"))
+        self.append("cation slot created\n")
+        self.assertEqual(self.follower.poll()[1], ["LOG: replication slot created"])
+        self.assertEqual(self.follower.offset, os.path.getsize(self.log))
+
+    def test_rotation_reads_rest_of_old_file(self):
+        self.append("LOG: standby 1\n")
+        self.follower.poll()
+        self.append("LOG: standby 2\n")
+        os.rename(self.log, self.log + ".1")
+        self.append("LOG: standby 3\n")
+        self.assertEqual(self.follower.poll()[1], ["LOG: standby 2", "LOG: standby 3"])
+
+    def test_truncated_file_is_reread(self):
+        self.append("LOG: standby 1\nLOG: standby 2\n")
+        self.follower.poll()
+        with open(self.log, "w") as f:
+            f.write("LOG: standby 3\n")
+        self.assertEqual(self.follower.poll()[1], ["LOG: standby 3"])
+
+    def test_reports_total_when_lines_are_capped(self):
+        self.append("".join(f"LOG: replication event {i}\n" for i in range(50)))
+        path, lines, total = self.follower.poll(max_lines=5)
+        self.assertEqual(total, 50)
+        self.assertEqual(lines, [f"LOG: replication event {i}" for i in range(45, 50)])
+
+    def test_from_end_skips_history(self):
+        self.append("LOG: replication old\nLOG: replication half")
+        self.assertEqual(self.follower.poll(from_end=True)[1], [])
+        self.append(" done\nLOG: replication new\n")
+        self.assertEqual(self.follower.poll(from_end=True)[1],
+                         ["LOG: replication half done", "LOG: replication new"])
+
+if __name__ == "__main__":
+    unittest.main()
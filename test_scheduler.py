@@ -0,0 +1,96 @@
+"""
+Проверки планировщика и ограничения частоты запросов из ResearchLab.
+Запуск: python -m unittest test_scheduler
+"""
+import time
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+import ResearchLab as bot
+
+class SchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_notification_does_not_leak_slot(self):
+        sched = bot.Scheduler(1, 10)
+
+        async def notify(position):
+            raise RuntimeError("reply failed")
+
+        first = asyncio.create_task(sched.submit(bot.PRIORITY_CHEAP, time.sleep, 0.05))
+        await asyncio.sleep(0)
+        with self.assertRaises(RuntimeError):
+            await sched.submit(bot.PRIORITY_CHEAP, time.sleep, 0, on_wait=notify)
+        await first
+        self.assertEqual(sched.running, 0)
+        self.assertEqual(sched.waiting(), 0)
+        await asyncio.wait_for(sched.submit(bot.PRIORITY_CHEAP, len, "ok"), timeout=1)
+
+    async def test_cancel_after_handoff_releases_slot(self):
+        sched = bot.Scheduler(1, 10)
+        started = asyncio.Event()
+
+        async def notify(position):
+            started.set()
+            await asyncio.sleep(1)
+
+        first = asyncio.create_task(sched.submit(bot.PRIORITY_CHEAP, time.sleep, 0.05))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(sched.submit(bot.PRIORITY_CHEAP, len, "x", on_wait=notify))
+        await started.wait()
+        await first
+        # слот уже передан ожидающему, пока тот отправлял уведомление
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(sched.running, 0)
+        self.assertEqual(await asyncio.wait_for(sched.submit(bot.PRIORITY_CHEAP, len, "ok"), timeout=1), 2)
+
+    async def test_priority_and_shedding(self):
+        sched = bot.Scheduler(1, 2)
+        order = []
+        first = asyncio.create_task(sched.submit(bot.PRIORITY_CHEAP, time.sleep, 0.05))
+        await asyncio.sleep(0)
+        heavy = asyncio.create_task(sched.submit(bot.PRIORITY_HEAVY, order.append, "heavy"))
+        cheap = asyncio.create_task(sched.submit(bot.PRIORITY_CHEAP, order.append, "cheap"))
+        await asyncio.sleep(0)
+        with self.assertRaises(bot.SchedulerOverloaded):
+            await sched.submit(bot.PRIORITY_CHEAP, len, "")
+        await asyncio.gather(first, heavy, cheap)
+        self.assertEqual(order, ["cheap", "heavy"])
+        self.assertEqual(sched.running, 0)
+
+class AdmitTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        bot.USER_BUCKETS.clear()
+        bot.COMMAND_BUCKETS.clear()
+        self.replies = []
+
+        async def reply_text(text):
+            self.replies.append(text)
+
+        message = SimpleNamespace(reply_text=reply_text)
+        self.update = SimpleNamespace(effective_user=SimpleNamespace(id=1), effective_message=message)
+
+    async def test_refused_command_does_not_charge_user_bucket(self):
+        bot.COMMAND_BUCKETS[(1, "get_ps")] = bot.TokenBucket(0.001, 0)
+        self.assertFalse(await bot.admit(self.update, "get_ps"))
+        self.assertEqual(bot.USER_BUCKETS[1].tokens, bot.USER_LIMIT[1])
+        self.assertTrue(await bot.admit(self.update, "get_uptime"))
+        self.assertAlmostEqual(bot.USER_BUCKETS[1].tokens, bot.USER_LIMIT[1] - 1, places=2)
+
+    async def test_idle_full_buckets_are_pruned(self):
+        bot.USER_BUCKETS[2] = bot.TokenBucket(1, 5)
+        bot.COMMAND_BUCKETS[(2, "get_ps")] = bot.TokenBucket(1, 5)
+        self.assertTrue(await bot.admit(self.update, "get_ps"))
+        past = time.monotonic() - bot.BUCKET_IDLE - 1
+        for bucket in (bot.USER_BUCKETS[2], bot.COMMAND_BUCKETS[(2, "get_ps")]):
+            bucket.updated = past
+        bot.USER_BUCKETS[1].tokens = 0
+        bot._buckets_pruned = past
+        bot.prune_buckets()
+        self.assertNotIn(2, bot.USER_BUCKETS)
+        self.assertNotIn((2, "get_ps"), bot.COMMAND_BUCKETS)
+        self.assertIn(1, bot.USER_BUCKETS)
+
+if __name__ == "__main__":
+    unittest.main()